@@ -12,6 +12,7 @@ from app.bot import bot
 import json
 
 from . import admin_kb as kb
+from app.servise.task_catalog import task_catalog
 
 logger = logging.getLogger(__name__)
 
@@ -939,6 +940,9 @@ async def process_task_channel_reward(message: Message, state: FSMContext):
         )
         return
 
+    # Новое задание сразу попадает в выдачу
+    task_catalog.invalidate()
+
     # Отправляем подтверждение
     channel_type = "подписчиков" if sab == 1 else "заявок"
     await message.answer(
@@ -970,6 +974,7 @@ async def handle_task_channel_action(callback: CallbackQuery):
         success = await qu.delete_task_channel(channel_id)
         
         if success:
+            task_catalog.invalidate()
             await callback.answer("✅ Канал успешно удален!", show_alert=True)
             # Обновляем список каналов
             await show_task_channels_list(callback)
@@ -981,6 +986,7 @@ async def handle_task_channel_action(callback: CallbackQuery):
         success = await qu.toggle_task_channel_status(channel_id)
         
         if success:
+            task_catalog.invalidate()
             # Получаем обновленную информацию о канале
             channel = await qu.get_task_channel(channel_id)
             if channel:
@@ -1016,6 +1022,13 @@ async def show_task_channel_details(callback: CallbackQuery, channel: dict):
         f"📈 Осталось: {channel['current_limit']}\n"
         f"💰 Награда: {channel['reward']} ⭐"
     )
+    if channel['sab'] and channel['completed_count']:
+        # Отписки находит фоновая перепроверка выполненных заданий
+        retained = channel['completed_count'] - channel['unsubscribed_count']
+        text += (
+            f"\n🔁 Удержано: {retained} из {channel['completed_count']} "
+            f"({retained / channel['completed_count'] * 100:.1f}%)"
+        )
     
     await callback.message.edit_text(
         text,
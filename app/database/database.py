@@ -1,7 +1,11 @@
 import logging
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, text, ForeignKey, Text, Boolean
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, DateTime, Float, text, ForeignKey, Text, Boolean, Index, inspect,
+    and_, delete, func, select
+)
+from sqlalchemy.schema import CreateColumn
 from config import Config
 from datetime import datetime
 from dotenv import load_dotenv
@@ -31,19 +35,78 @@ async def create_all_tables():
     logger.info(f"Available tables: {Base.metadata.tables.keys()}")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_sync_schema)
     logger.info("Tables created successfully!")
 
+def _sync_schema(connection):
+    """
+    Добавляет недостающие колонки и индексы в уже существующие таблицы.
+    create_all создает только новые таблицы и не меняет существующие.
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                logger.info(f"Добавлена колонка {table.name}.{column.name}")
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                if index.unique:
+                    # Уникальный индекс не создастся, пока в таблице есть дубли
+                    _delete_duplicates(connection, table, [column.name for column in index.columns])
+                index.create(connection)
+                logger.info(f"Создан индекс {index.name}")
+
+def _delete_duplicates(connection, table, columns, chunk_size: int = 1000):
+    """
+    Удаляет строки с повторяющимися значениями columns, оставляя по одной на ключ.
+    Остается строка с наименьшим id, а если в таблице есть completed — выполненная.
+    """
+    key = [table.c[name] for name in columns]
+    duplicates = select(*key).group_by(*key).having(func.count() > 1).subquery()
+    keep_order = [table.c.id]
+    if 'completed' in table.c:
+        keep_order.insert(0, table.c.completed.desc())
+
+    rows = connection.execute(
+        select(table.c.id, *key).join(
+            duplicates, and_(*[table.c[name] == duplicates.c[name] for name in columns])
+        ).order_by(*key, *keep_order)
+    ).all()
+
+    seen, extra_ids = set(), []
+    for row in rows:
+        row_key = tuple(row[1:])
+        if row_key in seen:
+            extra_ids.append(row.id)
+        else:
+            seen.add(row_key)
+
+    for start in range(0, len(extra_ids), chunk_size):
+        connection.execute(delete(table).where(table.c.id.in_(extra_ids[start:start + chunk_size])))
+    if extra_ids:
+        logger.info(f"Удалено дублей в {table.name}: {len(extra_ids)}")
+
 class User(Base):
     __tablename__ = "users"
     
     id = Column(Integer, primary_key=True)
     user_id = Column(BigInteger, unique=True, index=True, nullable=False)
     username = Column(String(255))
-    created_at = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, default=datetime.now, index=True)
     referred_by = Column(String(255), index=True)
     op_status = Column(Boolean, default=False)
-    balans = Column(Float, default=0)
+    balans = Column(Float, default=0, index=True)
     deposit = Column(Float, default=0)
+    is_reachable = Column(Boolean, default=True, server_default=text('1'), nullable=False, index=True)  # False, если бот заблокирован или аккаунт удален
+    unreachable_since = Column(DateTime)
 
 
 class OPChannel(Base):
@@ -56,6 +119,9 @@ class OPChannel(Base):
     button_name = Column(String(255), nullable=True)  # Название для кнопки
     limit = Column(Integer, default=10000)
     is_active = Column(Boolean, default=True)
+    health_status = Column(String(20))  # ok / no_rights / not_found, NULL — еще не проверялся
+    health_error = Column(String(255))
+    health_checked_at = Column(DateTime)
 
 
 class Chanel(Base):
@@ -70,15 +136,92 @@ class Chanel(Base):
     sab = Column(Boolean, default=True)
     limit = Column(BigInteger)
     reward = Column(Float)
+    health_status = Column(String(20))  # ok / no_rights / not_found, NULL — еще не проверялся
+    health_error = Column(String(255))
+    health_checked_at = Column(DateTime)
 
 class UserTask(Base):
     __tablename__ = 'user_tasks'
+    __table_args__ = (
+        # Одна запись на пару (пользователь, задание); покрывает и поиск по user_id
+        Index('ux_user_tasks_user_task', 'user_id', 'task_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(BigInteger, nullable=False, index=True)
+    user_id = Column(BigInteger, nullable=False)
     task_id = Column(Integer, nullable=False, index=True)
     completed = Column(Boolean, default=False)
-    completed_at = Column(DateTime)
+    completed_at = Column(DateTime, index=True)
+    verified_at = Column(DateTime)  # Последняя повторная проверка подписки после выполнения
+    unsubscribed_at = Column(DateTime)  # Когда обнаружена отписка после выполнения задания
+
+
+class BroadcastJob(Base):
+    """Таблица задач рассылки, позволяет продолжить рассылку после перезапуска"""
+    __tablename__ = 'broadcast_jobs'
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String(20), default='running', index=True)  # scheduled / running / completed / cancelled
+    scheduled_at = Column(DateTime, index=True)  # Время запуска отложенной рассылки
+    payload = Column(Text, nullable=False)  # JSON с содержимым сообщения
+    filters = Column(Text)  # JSON с фильтрами аудитории, NULL — все пользователи
+    total = Column(Integer, default=0)  # Количество получателей на момент запуска
+    last_user_pk = Column(Integer, default=0)  # Чекпоинт: users.id, до которого все получатели обработаны
+    success = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_by = Column(BigInteger)  # Telegram ID админа
+    status_chat_id = Column(BigInteger)  # Чат с сообщением прогресса
+    status_message_id = Column(BigInteger)  # ID сообщения прогресса
+    owner = Column(String(64))  # Процесс-координатор: обновляет прогресс и завершает рассылку
+    lease_until = Column(DateTime)  # До какого времени действует аренда координатора
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_at = Column(DateTime)
+
+
+class BroadcastShard(Base):
+    """Диапазон users.id рассылки, который воркер захватывает в аренду"""
+    __tablename__ = 'broadcast_shards'
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("broadcast_jobs.id"), nullable=False, index=True)
+    start_pk = Column(Integer, nullable=False)  # Нижняя граница диапазона (не включительно)
+    end_pk = Column(Integer, nullable=False)  # Верхняя граница диапазона (включительно)
+    checkpoint_pk = Column(Integer, nullable=False)  # users.id, до которого диапазон обработан
+    status = Column(String(20), default='pending', index=True)  # pending / running / done
+    owner = Column(String(64))  # Воркер, который держит аренду
+    lease_until = Column(DateTime)
+    success = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    unreachable = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class BroadcastDelivery(Base):
+    """Результат доставки рассылки одному получателю, пишется пачками"""
+    __tablename__ = 'broadcast_deliveries'
+    __table_args__ = (
+        Index('ix_broadcast_deliveries_job_status', 'job_id', 'status'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("broadcast_jobs.id"), nullable=False)
+    user_pk = Column(Integer, nullable=False)  # users.id, для повторной рассылки по ключу
+    user_id = Column(BigInteger, nullable=False, index=True)  # Telegram ID, для истории пользователя
+    status = Column(String(20), nullable=False)  # sent / failed / unreachable
+    error = Column(String(255))
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class JoinRequest(Base):
+    """Заявки на вступление в каналы, общие для всех процессов бота и переживающие перезапуск"""
+    __tablename__ = 'join_requests'
+
+    channel_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, default=datetime.now)
+    expires_at = Column(DateTime, nullable=False, index=True)
 
 
 class AdPostShow(Base):
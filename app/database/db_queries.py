@@ -2,18 +2,36 @@ from sqlalchemy.future import select
 from sqlalchemy import update, func, insert, delete
 from datetime import datetime, timedelta
 from . import database as db
-from .database import AsyncSessionFactory
+from .database import AsyncSessionFactory, engine
+from sqlalchemy.dialects import mysql, sqlite
 from sqlalchemy.exc import OperationalError
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
 from config import Config
 import random
+from dataclasses import dataclass
 import string
-from sqlalchemy import and_
+import json
+from sqlalchemy import and_, cast, String
+from sqlalchemy.orm import aliased
 import logging
 from sqlalchemy import case
 
 logger = logging.getLogger(__name__)
 
+def _upsert(model, rows: List[dict], update_columns: List[str]):
+    """
+    Многострочный INSERT, который при конфликте ключа обновляет update_columns.
+    Основная база — MySQL (ON DUPLICATE KEY UPDATE), SQLite используется в бенчмарках.
+    """
+    if engine.dialect.name == 'sqlite':
+        stmt = sqlite.insert(model).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=[column.name for column in model.__table__.primary_key],
+            set_={name: stmt.excluded[name] for name in update_columns}
+        )
+    stmt = mysql.insert(model).values(rows)
+    return stmt.on_duplicate_key_update({name: stmt.inserted[name] for name in update_columns})
+
 async def register_user(user_id: int, username: str, referred_by: str):
     """
     Регистрирует нового пользователя в базе данных.
@@ -101,18 +119,185 @@ async def register_user(user_id: int, username: str, referred_by: str):
         
         return True
 
-async def get_all_users():
+def _recipient_conditions(filters: Optional[dict] = None, reachable_only: bool = True) -> list:
+    """
+    Собирает условия WHERE для выборки получателей рассылки.
+    
+    Args:
+        filters (Optional[dict]): Фильтры аудитории:
+            op_status (bool) — прошел ли пользователь ОП,
+            referred_by (str) — реферальный код или ID пригласившего,
+            created_from / created_to (str, YYYY-MM-DD) — период регистрации включительно,
+            min_balans (float) — минимальный баланс,
+            min_tasks (int) — минимум выполненных заданий,
+            failed_in_job (int) — не получили сообщение рассылки с этим ID
+        reachable_only (bool): Пропускать пользователей, заблокировавших бота
+        
+    Returns:
+        list: Список условий для where()
+    """
+    conditions = []
+    if reachable_only:
+        conditions.append(db.User.is_reachable == True)
+    if not filters:
+        return conditions
+    
+    if filters.get('op_status') is not None:
+        conditions.append(db.User.op_status == bool(filters['op_status']))
+    if filters.get('referred_by'):
+        conditions.append(db.User.referred_by == str(filters['referred_by']))
+    if filters.get('created_from'):
+        conditions.append(db.User.created_at >= datetime.fromisoformat(filters['created_from']))
+    if filters.get('created_to'):
+        conditions.append(db.User.created_at < datetime.fromisoformat(filters['created_to']) + timedelta(days=1))
+    if filters.get('min_balans') is not None:
+        conditions.append(db.User.balans >= float(filters['min_balans']))
+    if filters.get('min_tasks'):
+        completed_users = select(db.UserTask.user_id).where(
+            db.UserTask.completed == True
+        ).group_by(db.UserTask.user_id).having(func.count(db.UserTask.id) >= int(filters['min_tasks']))
+        conditions.append(db.User.user_id.in_(completed_users))
+    if filters.get('failed_in_job'):
+        failed_users = select(db.BroadcastDelivery.user_pk).where(
+            db.BroadcastDelivery.job_id == int(filters['failed_in_job']),
+            db.BroadcastDelivery.status == 'failed'
+        )
+        conditions.append(db.User.id.in_(failed_users))
+    return conditions
+
+
+async def count_broadcast_recipients(filters: Optional[dict] = None) -> int:
     """
-    Получает список всех пользователей из базы данных.
+    Считает получателей рассылки одним COUNT-запросом, не загружая строки.
     
+    Args:
+        filters (Optional[dict]): Фильтры аудитории (см. _recipient_conditions)
+        
     Returns:
-        List[User]: Список всех пользователей
+        int: Количество получателей
     """
     async with AsyncSessionFactory() as session:
-        async with session.begin():
-            stmt = select(db.User)
+        result = await session.execute(
+            select(func.count(db.User.id)).where(*_recipient_conditions(filters))
+        )
+        return result.scalar_one() or 0
+
+
+def _template_columns(fields: Optional[List[str]]) -> list:
+    """
+    Колонки для подстановок персонализированной рассылки.
+    Приглашенные считаются коррелированным подзапросом по индексу referred_by,
+    поэтому все поля приходят тем же запросом, что и пачка получателей.
+    
+    Args:
+        fields (Optional[List[str]]): Имена полей (balans, invites, username, user_id)
+        
+    Returns:
+        list: Выражения с метками для select()
+    """
+    columns = []
+    for field in fields or []:
+        if field == 'balans':
+            columns.append(db.User.balans.label('balans'))
+        elif field == 'username':
+            columns.append(db.User.username.label('username'))
+        elif field == 'user_id':
+            columns.append(db.User.user_id.label('tg_id'))
+        elif field == 'invites':
+            referral = aliased(db.User)
+            columns.append(
+                select(func.count(referral.id)).where(
+                    referral.referred_by == cast(db.User.user_id, String)
+                ).correlate(db.User).scalar_subquery().label('invites')
+            )
+    return columns
+
+
+def _template_values(row, fields: List[str]) -> dict:
+    values = {field: getattr(row, field) for field in fields if field != 'user_id'}
+    if 'user_id' in fields:
+        values['user_id'] = row.tg_id
+    return values
+
+
+async def get_user_template_values(user_id: int, fields: List[str]) -> dict:
+    """
+    Значения подстановок для одного пользователя (предпросмотр рассылки).
+    
+    Args:
+        user_id (int): Telegram ID пользователя
+        fields (List[str]): Имена полей
+        
+    Returns:
+        dict: {поле: значение}, пустой словарь, если пользователь не найден
+    """
+    columns = _template_columns(fields)
+    if not columns:
+        return {}
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(select(*columns).where(db.User.user_id == user_id))
+        row = result.first()
+        return _template_values(row, fields) if row else {}
+
+
+async def iter_users(after_id: int = 0, until_id: Optional[int] = None, batch_size: int = 1000,
+                     reachable_only: bool = True, filters: Optional[dict] = None,
+                     fields: Optional[List[str]] = None) -> AsyncIterator[list]:
+    """
+    Построчно обходит пользователей пачками с keyset-пагинацией по users.id.
+    Загружает только users.id и Telegram ID, поэтому память не растет с числом пользователей.
+    
+    Args:
+        after_id (int): users.id, после которого начинать обход (чекпоинт)
+        until_id (Optional[int]): Последний users.id диапазона (включительно)
+        batch_size (int): Размер пачки
+        reachable_only (bool): Пропускать пользователей, заблокировавших бота
+        filters (Optional[dict]): Фильтры аудитории (см. _recipient_conditions)
+        fields (Optional[List[str]]): Поля для персонализации, читаются тем же запросом
+        
+    Yields:
+        list: Пачка строк с полями id и user_id, а при заданных fields —
+            тройки (id, user_id, {поле: значение})
+    """
+    conditions = _recipient_conditions(filters, reachable_only)
+    if until_id is not None:
+        conditions.append(db.User.id <= until_id)
+    
+    last_id = after_id
+    while True:
+        async with AsyncSessionFactory() as session:
+            stmt = select(db.User.id, db.User.user_id, *_template_columns(fields)).where(
+                db.User.id > last_id, *conditions
+            ).order_by(db.User.id).limit(batch_size)
             result = await session.execute(stmt)
-            return result.scalars().all()
+            rows = result.all()
+        
+        if not rows:
+            return
+        
+        last_id = rows[-1].id
+        if fields:
+            yield [(row.id, row.user_id, _template_values(row, fields)) for row in rows]
+        else:
+            yield rows
+        
+        if len(rows) < batch_size:
+            return
+
+
+async def iter_user_ids(batch_size: int = 1000, filters: Optional[dict] = None) -> AsyncIterator[List[int]]:
+    """
+    Построчно обходит Telegram ID пользователей пачками, включая заблокировавших бота.
+    
+    Args:
+        batch_size (int): Размер пачки
+        filters (Optional[dict]): Фильтры пользователей (см. _recipient_conditions)
+        
+    Yields:
+        List[int]: Пачка Telegram ID пользователей
+    """
+    async for rows in iter_users(batch_size=batch_size, reachable_only=False, filters=filters):
+        yield [row.user_id for row in rows]
 
 
 async def get_user(user_id: int):
@@ -132,6 +317,44 @@ async def get_user(user_id: int):
             return result.scalars().first()
 
 
+async def mark_users_unreachable(user_ids: List[int]):
+    """
+    Помечает пользователей недоступными для рассылки (бот заблокирован или аккаунт удален).
+    
+    Args:
+        user_ids (List[int]): Telegram ID пользователей
+    """
+    if not user_ids:
+        return
+    async with AsyncSessionFactory() as session:
+        stmt = update(db.User).where(
+            db.User.user_id.in_(user_ids),
+            db.User.is_reachable == True
+        ).values(is_reachable=False, unreachable_since=datetime.now())
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def mark_user_reachable(user_id: int) -> bool:
+    """
+    Возвращает пользователя в рассылки, если он снова написал боту.
+    
+    Args:
+        user_id (int): Telegram ID пользователя
+        
+    Returns:
+        bool: True если пользователь был недоступен и теперь восстановлен
+    """
+    async with AsyncSessionFactory() as session:
+        stmt = update(db.User).where(
+            db.User.user_id == user_id,
+            db.User.is_reachable == False
+        ).values(is_reachable=True, unreachable_since=None)
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount > 0
+
+
 async def get_invite_count(user_id: int) -> int:
     """Получает количество приглашенных пользователей (рефералов)
     
@@ -264,6 +487,11 @@ async def process_gift_withdrawal(user_id: int, gift_price: float) -> tuple[bool
 
 #Запросы для заданий 
 
+def _channel_healthy(model):
+    """Условие: канал не помечен фоновой проверкой как несуществующий"""
+    return (model.health_status == None) | (model.health_status != 'not_found')
+
+
 async def get_active_chanels():
     """
     Получает список всех активных каналов.
@@ -276,102 +504,121 @@ async def get_active_chanels():
         result = await session.execute(stmt)
         return result.scalars().all()
 
-async def get_next_task(user_id: int):
+async def get_task_catalog():
     """
-    Получает следующее доступное задание для пользователя.
+    Получает задания, которые можно выдавать: активные, с остатком лимита
+    и не помеченные фоновой проверкой как удаленные.
     
-    Args:
-        user_id (int): ID пользователя
-        
     Returns:
-        Chanel: Следующее доступное задание или None, если заданий больше нет
+        list: Каналы заданий в порядке выдачи (по ID)
     """
     async with AsyncSessionFactory() as session:
-        stmt = select(db.Chanel).outerjoin(
-            db.UserTask, (db.Chanel.id == db.UserTask.task_id) & (db.UserTask.user_id == user_id)
-        ).where(
-            (db.UserTask.id == None) | (db.UserTask.completed == False)
+        stmt = select(db.Chanel).where(
+            db.Chanel.is_active == True,
+            db.Chanel.limit > 0,
+            _channel_healthy(db.Chanel)
         ).order_by(db.Chanel.id)
         result = await session.execute(stmt)
-        return result.scalars().first()
+        return result.scalars().all()
 
-async def mark_task_completed(user_id: int, task_id: int):
+async def get_completed_task_ids(user_id: int) -> List[int]:
     """
-    Отмечает задание как выполненное.
+    Получает ID заданий, выполненных пользователем.
     
     Args:
         user_id (int): ID пользователя
-        task_id (int): ID задания
-    """
-    async with AsyncSessionFactory() as session:
-        stmt = update(db.UserTask).where(
-            (db.UserTask.user_id == user_id) & (db.UserTask.task_id == task_id)
-        ).values(completed=True, completed_at=datetime.now())
-        await session.execute(stmt)
-        await session.commit()
-
-async def decrease_channel_limit(channel_id: int):
-    """
-    Уменьшает лимит канала на 1 и деактивирует его, если лимит достиг 0.
-    
-    Args:
-        channel_id (int): ID канала
+        
+    Returns:
+        List[int]: ID выполненных заданий
     """
     async with AsyncSessionFactory() as session:
-        stmt = select(db.Chanel).where(db.Chanel.id == channel_id)
+        stmt = select(db.UserTask.task_id).where(
+            db.UserTask.user_id == user_id, db.UserTask.completed == True
+        )
         result = await session.execute(stmt)
-        channel = result.scalars().first()
+        return result.scalars().all()
 
-        if channel and channel.limit > 0:
-            channel.limit -= 1
-            if channel.limit == 0:
-                channel.is_active = False
-            await session.commit()
+@dataclass
+class TaskCompletion:
+    """Итог complete_task"""
+    completed: bool  # Задание засчитано этим вызовом и награда начислена
+    limit_decreased: bool  # Лимит канала уменьшен (False — лимит уже был исчерпан)
+    already_completed: bool = False  # Задание было выполнено раньше (False без completed — записи нет)
 
-async def add_reward_to_user(user_id: int, reward: int):
+async def complete_task(user_id: int, task_id: int) -> TaskCompletion:
     """
-    Начисляет награду пользователю.
+    Засчитывает выполнение задания в одной транзакции условными UPDATE:
+    отмечает задание выполненным, только если оно еще не выполнено, уменьшает
+    лимит канала, только если он больше 0 (на последнем выполнении канал
+    отключается), и начисляет награду через balans = balans + reward.
+    Параллельные нажатия не засчитают задание дважды и не потеряют списания лимита.
     
     Args:
         user_id (int): ID пользователя
-        reward (int): Количество награды для начисления
-    """
-    async with AsyncSessionFactory() as session:
-        stmt = select(db.User).where(db.User.user_id == user_id)
-        result = await session.execute(stmt)
-        user = result.scalars().first()
-        user.balans += reward
-        await session.commit()
-
-async def get_user_task(user_id: int, task_id: int):
-    """
-    Получает информацию о задании пользователя.
-    
-    Args:
-        user_id (int): ID пользователя
-        task_id (int): ID задания
+        task_id (int): ID задания (chanels.id)
         
     Returns:
-        UserTask: Информация о задании пользователя или None, если задание не найдено
+        TaskCompletion: Что изменилось
     """
     async with AsyncSessionFactory() as session:
-        stmt = select(db.UserTask).where(
-            db.UserTask.user_id == user_id, db.UserTask.task_id == task_id
-        )
-        result = await session.execute(stmt)
-        return result.scalars().first()
+        async with session.begin():
+            result = await session.execute(
+                update(db.UserTask).where(
+                    db.UserTask.user_id == user_id,
+                    db.UserTask.task_id == task_id,
+                    (db.UserTask.completed == False) | (db.UserTask.completed == None)
+                ).values(completed=True, completed_at=datetime.now())
+            )
+            if result.rowcount == 0:
+                # Задание уже выполнено (например, двойное нажатие) или не выдавалось.
+                # Лишний SELECT только на этом редком пути
+                existing = await session.execute(
+                    select(db.UserTask.id).where(
+                        db.UserTask.user_id == user_id, db.UserTask.task_id == task_id
+                    ).limit(1)
+                )
+                return TaskCompletion(
+                    completed=False, limit_decreased=False,
+                    already_completed=existing.first() is not None
+                )
+
+            # MySQL вычисляет SET слева направо, поэтому is_active считается до изменения limit
+            result = await session.execute(
+                update(db.Chanel).where(
+                    db.Chanel.id == task_id, db.Chanel.limit > 0
+                ).ordered_values(
+                    (db.Chanel.is_active, case((db.Chanel.limit <= 1, False), else_=db.Chanel.is_active)),
+                    (db.Chanel.limit, db.Chanel.limit - 1),
+                )
+            )
+            limit_decreased = result.rowcount > 0
+
+            reward = select(func.coalesce(db.Chanel.reward, 0)).where(db.Chanel.id == task_id).scalar_subquery()
+            await session.execute(
+                update(db.User).where(db.User.user_id == user_id).values(balans=db.User.balans + reward)
+            )
+    return TaskCompletion(completed=True, limit_decreased=limit_decreased)
 
-async def add_user_task(user_id: int, task_id: int):
+async def ensure_user_task(user_id: int, task_id: int):
     """
-    Добавляет новое задание пользователю.
+    Добавляет задание пользователю, если записи еще нет, одним INSERT.
+    Повторный вызов (например, двойное нажатие) упирается в уникальный
+    индекс (user_id, task_id) и ничего не меняет.
     
     Args:
         user_id (int): ID пользователя
         task_id (int): ID задания
     """
+    row = {'user_id': user_id, 'task_id': task_id, 'completed': False}
+    if engine.dialect.name == 'sqlite':
+        stmt = sqlite.insert(db.UserTask).values(row).on_conflict_do_nothing(
+            index_elements=['user_id', 'task_id']
+        )
+    else:
+        stmt = mysql.insert(db.UserTask).values(row)
+        stmt = stmt.on_duplicate_key_update(task_id=db.UserTask.task_id)
     async with AsyncSessionFactory() as session:
-        new_task = db.UserTask(user_id=user_id, task_id=task_id)
-        session.add(new_task)
+        await session.execute(stmt)
         await session.commit()
 
 async def get_channel_by_task_id(task_id: int):
@@ -397,7 +644,7 @@ async def get_active_sponsor_channels():
         list: Список активных спонсорских каналов
     """
     async with AsyncSessionFactory() as session:
-        stmt = select(db.OPChannel).where(db.OPChannel.is_active == True)
+        stmt = select(db.OPChannel).where(db.OPChannel.is_active == True, _channel_healthy(db.OPChannel))
         result = await session.execute(stmt)
         return result.scalars().all()
 
@@ -1096,7 +1343,10 @@ async def get_task_channel(channel_id: int) -> Optional[dict]:
         # Получаем канал и считаем количество выполненных заданий
         stmt = select(
             db.Chanel,
-            func.sum(case((db.UserTask.completed == True, 1), else_=0)).label('completed_count')
+            func.sum(case((db.UserTask.completed == True, 1), else_=0)).label('completed_count'),
+            func.sum(case(
+                ((db.UserTask.completed == True) & (db.UserTask.unsubscribed_at != None), 1), else_=0
+            )).label('unsubscribed_count')
         ).outerjoin(
             db.UserTask,
             db.Chanel.id == db.UserTask.task_id
@@ -1120,6 +1370,7 @@ async def get_task_channel(channel_id: int) -> Optional[dict]:
                 'current_limit': channel.Chanel.limit,  # Текущий оставшийся лимит
                 'reward': channel.Chanel.reward,
                 'completed_count': int(channel.completed_count or 0),
+                'unsubscribed_count': int(channel.unsubscribed_count or 0),  # Отписались после выполнения
                 'sab': channel.Chanel.sab  # Добавляем тип канала
             }
         return None
@@ -1437,45 +1688,554 @@ async def update_user_op_status(user_id: int, status: bool = True):
 async def get_referral_stats(referral_code: str) -> dict:
     """Получает расширенную статистику по реферальной ссылке"""
     async with AsyncSessionFactory() as session:
-        # Получаем всех пользователей с этой реферальной ссылкой
-        stmt = select(db.User).where(db.User.referred_by == referral_code)
-        result = await session.execute(stmt)
-        users = result.scalars().all()
-        
-        total_users = len(users)
-        completed_op = sum(1 for user in users if user.op_status)
+        # Количество рефералов и прошедших ОП считаем в БД, не загружая пользователей
+        stmt = select(
+            func.count(db.User.id),
+            func.coalesce(func.sum(case((db.User.op_status == True, 1), else_=0)), 0)
+        ).where(db.User.referred_by == referral_code)
+        total_users, completed_op = (await session.execute(stmt)).one()
+    
+    # Статистика по заданиям
+    started_tasks = 0  # Начатые задания
+    completed_tasks = 0  # Выполненные задания
+    
+    # Задания рефералов считаем пачками Telegram ID, чтобы не строить IN на всех рефералов сразу
+    async for telegram_ids in iter_user_ids(filters={'referred_by': referral_code}):
+        async with AsyncSessionFactory() as session:
+            stmt = select(
+                func.count(db.UserTask.id),
+                func.coalesce(func.sum(case((db.UserTask.completed == True, 1), else_=0)), 0)
+            ).where(db.UserTask.user_id.in_(telegram_ids))
+            started, completed = (await session.execute(stmt)).one()
+        started_tasks += started
+        completed_tasks += completed
+    
+    return {
+        "total_users": total_users,
+        "completed_op": int(completed_op),
+        "tasks": {
+            "started": started_tasks,  # Общее количество начатых заданий
+            "completed": int(completed_tasks),  # Количество выполненных заданий
+            "in_progress": started_tasks - int(completed_tasks)  # Задания в процессе
+        }
+    }
+
+
+#Запросы для рассылок
+
+async def _create_broadcast_shards(session, job_id: int, after_pk: int, filters: Optional[dict] = None) -> int:
+    """
+    Делит получателей рассылки на диапазоны users.id примерно по BROADCAST_SHARD_SIZE получателей.
+    
+    Args:
+        session: Сессия БД
+        job_id (int): ID задачи рассылки
+        after_pk (int): users.id, после которого начинаются получатели
+        filters (Optional[dict]): Фильтры аудитории
         
-        # Статистика по заданиям
-        started_tasks = 0  # Начатые задания
-        completed_tasks = 0  # Выполненные задания
+    Returns:
+        int: Количество созданных диапазонов
+    """
+    result = await session.execute(
+        select(func.min(db.User.id), func.max(db.User.id), func.count(db.User.id)).where(
+            db.User.id > after_pk,
+            *_recipient_conditions(filters)
+        )
+    )
+    min_id, max_id, count = result.one()
+    if not count:
+        return 0
+    
+    shards = -(-count // Config.BROADCAST_SHARD_SIZE)
+    width = -(-(max_id - min_id + 1) // shards)
+    start = min_id - 1
+    for i in range(shards):
+        end = max_id if i == shards - 1 else start + width
+        session.add(db.BroadcastShard(
+            job_id=job_id,
+            start_pk=start,
+            end_pk=end,
+            checkpoint_pk=start,
+            status='pending'
+        ))
+        start = end
+    return shards
+
+async def create_broadcast_job(payload: str, total: int, created_by: int,
+                               status_chat_id: int, status_message_id: int,
+                               filters: Optional[dict] = None,
+                               scheduled_at: Optional[datetime] = None) -> int:
+    """
+    Создает задачу рассылки вместе с диапазонами получателей.
+    Отложенная рассылка получает диапазоны при запуске, когда аудитория уже известна.
+    
+    Args:
+        payload (str): JSON с содержимым сообщения
+        total (int): Количество получателей
+        created_by (int): Telegram ID админа
+        status_chat_id (int): Чат с сообщением прогресса
+        status_message_id (int): ID сообщения прогресса
+        filters (Optional[dict]): Фильтры аудитории
+        scheduled_at (Optional[datetime]): Время запуска отложенной рассылки
         
-        # Получаем все задания для всех рефералов одним запросом
-        if users:
-            telegram_ids = [user.user_id for user in users]  # Используем Telegram ID пользователя
-            # Подсчитываем начатые задания
-            started_stmt = select(func.count()).select_from(db.UserTask).where(
-                db.UserTask.user_id.in_(telegram_ids)
+    Returns:
+        int: ID созданной задачи
+    """
+    async with AsyncSessionFactory() as session:
+        async with session.begin():
+            job = db.BroadcastJob(
+                payload=payload,
+                filters=json.dumps(filters, ensure_ascii=False) if filters else None,
+                total=total,
+                created_by=created_by,
+                status_chat_id=status_chat_id,
+                status_message_id=status_message_id,
+                scheduled_at=scheduled_at,
+                started_at=None if scheduled_at else datetime.now(),
+                status='scheduled' if scheduled_at else 'running'
             )
-            started_result = await session.execute(started_stmt)
-            started_tasks = started_result.scalar_one() or 0
-            
-            # Подсчитываем выполненные задания
-            completed_stmt = select(func.count()).select_from(db.UserTask).where(
-                and_(
-                    db.UserTask.user_id.in_(telegram_ids),
-                    db.UserTask.completed == True
+            session.add(job)
+            await session.flush()
+            if not scheduled_at:
+                await _create_broadcast_shards(session, job.id, 0, filters)
+        return job.id
+
+async def activate_due_broadcast_jobs() -> List[int]:
+    """
+    Запускает отложенные рассылки, время которых наступило.
+    Каждая задача переводится в running вместе с подсчетом получателей и созданием
+    диапазонов в одной транзакции; SKIP LOCKED не дает двум процессам запустить ее дважды.
+    
+    Returns:
+        List[int]: ID запущенных задач
+    """
+    activated = []
+    async with AsyncSessionFactory() as session:
+        async with session.begin():
+            result = await session.execute(
+                select(db.BroadcastJob).where(
+                    db.BroadcastJob.status == 'scheduled',
+                    db.BroadcastJob.scheduled_at <= datetime.now()
+                ).order_by(db.BroadcastJob.scheduled_at).with_for_update(skip_locked=True)
+            )
+            for job in result.scalars().all():
+                filters = json.loads(job.filters) if job.filters else None
+                count = await session.execute(
+                    select(func.count(db.User.id)).where(*_recipient_conditions(filters))
                 )
+                job.total = count.scalar_one() or 0
+                job.status = 'running'
+                job.started_at = datetime.now()
+                await _create_broadcast_shards(session, job.id, 0, filters)
+                activated.append(job.id)
+    return activated
+
+async def get_scheduled_broadcast_jobs() -> list:
+    """Получает запланированные рассылки по времени запуска"""
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(db.BroadcastJob).where(
+                db.BroadcastJob.status == 'scheduled'
+            ).order_by(db.BroadcastJob.scheduled_at)
+        )
+        return result.scalars().all()
+
+async def ensure_broadcast_shards(job_id: int, after_pk: int = 0, filters: Optional[dict] = None) -> int:
+    """
+    Создает диапазоны для задачи, у которой их еще нет (задачи, созданные до шардирования).
+    
+    Args:
+        job_id (int): ID задачи
+        after_pk (int): Сохраненный чекпоинт задачи
+        filters (Optional[dict]): Фильтры аудитории
+        
+    Returns:
+        int: Количество созданных диапазонов
+    """
+    async with AsyncSessionFactory() as session:
+        async with session.begin():
+            result = await session.execute(
+                select(func.count(db.BroadcastShard.id)).where(db.BroadcastShard.job_id == job_id)
             )
-            completed_result = await session.execute(completed_stmt)
-            completed_tasks = completed_result.scalar_one() or 0
+            if result.scalar_one():
+                return 0
+            return await _create_broadcast_shards(session, job_id, after_pk, filters)
+
+async def get_broadcast_job(job_id: int) -> Optional[db.BroadcastJob]:
+    """Получает задачу рассылки по ID"""
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(db.BroadcastJob).where(db.BroadcastJob.id == job_id)
+        )
+        return result.scalar_one_or_none()
+
+async def get_unfinished_broadcast_jobs() -> list:
+    """Получает незавершенные задачи рассылки"""
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(db.BroadcastJob).where(
+                db.BroadcastJob.status == 'running'
+            ).order_by(db.BroadcastJob.id)
+        )
+        return result.scalars().all()
+
+async def claim_broadcast_job_lease(job_id: int, owner: str, lease_seconds: int) -> bool:
+    """
+    Захватывает или продлевает аренду координатора рассылки.
+    
+    Args:
+        job_id (int): ID задачи
+        owner (str): Идентификатор процесса
+        lease_seconds (int): Срок аренды
+        
+    Returns:
+        bool: True если аренда принадлежит этому процессу
+    """
+    now = datetime.now()
+    async with AsyncSessionFactory() as session:
+        stmt = update(db.BroadcastJob).where(
+            db.BroadcastJob.id == job_id,
+            db.BroadcastJob.status == 'running',
+            (db.BroadcastJob.owner == None) | (db.BroadcastJob.owner == owner) | (db.BroadcastJob.lease_until < now)
+        ).values(owner=owner, lease_until=now + timedelta(seconds=lease_seconds))
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount > 0
+
+async def claim_broadcast_shard(job_id: int, owner: str, lease_seconds: int) -> Optional[db.BroadcastShard]:
+    """
+    Захватывает свободный диапазон рассылки: новый или с истекшей арендой упавшего воркера.
+    Строки, заблокированные другими воркерами, пропускаются (SKIP LOCKED).
+    
+    Args:
+        job_id (int): ID задачи
+        owner (str): Идентификатор воркера
+        lease_seconds (int): Срок аренды
         
+    Returns:
+        Optional[BroadcastShard]: Захваченный диапазон или None
+    """
+    now = datetime.now()
+    async with AsyncSessionFactory() as session:
+        async with session.begin():
+            stmt = select(db.BroadcastShard).where(
+                db.BroadcastShard.job_id == job_id,
+                db.BroadcastShard.status != 'done',
+                (db.BroadcastShard.owner == None) | (db.BroadcastShard.lease_until < now)
+            ).order_by(db.BroadcastShard.id).limit(1).with_for_update(skip_locked=True)
+            result = await session.execute(stmt)
+            shard = result.scalar_one_or_none()
+            if not shard:
+                return None
+            
+            shard.owner = owner
+            shard.status = 'running'
+            shard.lease_until = now + timedelta(seconds=lease_seconds)
+        return shard
+
+async def update_broadcast_shard_progress(shard_id: int, owner: str, checkpoint_pk: int,
+                                          success: int, failed: int, unreachable: int,
+                                          lease_seconds: int, done: bool = False) -> bool:
+    """
+    Сохраняет чекпоинт и счетчики диапазона и продлевает аренду.
+    Обновление проходит, только если аренда все еще принадлежит воркеру.
+    
+    Args:
+        shard_id (int): ID диапазона
+        owner (str): Идентификатор воркера
+        checkpoint_pk (int): users.id, до которого диапазон обработан
+        success (int): Количество успешных отправок
+        failed (int): Количество ошибок
+        unreachable (int): Количество недоступных получателей
+        lease_seconds (int): Срок аренды
+        done (bool): Диапазон обработан полностью
+        
+    Returns:
+        bool: False если аренду перехватил другой воркер
+    """
+    values = dict(
+        checkpoint_pk=checkpoint_pk,
+        success=success,
+        failed=failed,
+        unreachable=unreachable,
+        lease_until=datetime.now() + timedelta(seconds=lease_seconds)
+    )
+    if done:
+        values.update(status='done', owner=None, lease_until=None)
+    
+    async with AsyncSessionFactory() as session:
+        stmt = update(db.BroadcastShard).where(
+            db.BroadcastShard.id == shard_id,
+            db.BroadcastShard.owner == owner
+        ).values(**values)
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount > 0
+
+async def get_broadcast_job_totals(job_id: int) -> dict:
+    """
+    Суммирует счетчики всех диапазонов рассылки.
+    
+    Returns:
+        dict: success, failed, unreachable, shards, done_shards
+    """
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(
+                func.coalesce(func.sum(db.BroadcastShard.success), 0),
+                func.coalesce(func.sum(db.BroadcastShard.failed), 0),
+                func.coalesce(func.sum(db.BroadcastShard.unreachable), 0),
+                func.count(db.BroadcastShard.id),
+                func.coalesce(func.sum(case((db.BroadcastShard.status == 'done', 1), else_=0)), 0)
+            ).where(db.BroadcastShard.job_id == job_id)
+        )
+        success, failed, unreachable, shards, done_shards = result.one()
         return {
-            "total_users": total_users,
-            "completed_op": completed_op,
-            "tasks": {
-                "started": started_tasks,  # Общее количество начатых заданий
-                "completed": completed_tasks,  # Количество выполненных заданий
-                "in_progress": started_tasks - completed_tasks  # Задания в процессе
-            }
+            'success': int(success),
+            'failed': int(failed),
+            'unreachable': int(unreachable),
+            'shards': shards,
+            'done_shards': int(done_shards)
         }
 
+async def count_active_broadcast_workers() -> int:
+    """Считает воркеры, которые сейчас держат аренду диапазонов (для деления общего лимита)"""
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(func.count(func.distinct(db.BroadcastShard.owner))).where(
+                db.BroadcastShard.status == 'running',
+                db.BroadcastShard.lease_until > datetime.now()
+            )
+        )
+        return result.scalar_one() or 0
+
+async def cancel_broadcast_job(job_id: int, scheduled: bool = False) -> bool:
+    """
+    Отменяет рассылку. Воркеры увидят новый статус при продлении аренды.
+    
+    Args:
+        job_id (int): ID задачи
+        scheduled (bool): Отменить запланированную, а не идущую рассылку
+    
+    Returns:
+        bool: True если рассылка была активна
+    """
+    async with AsyncSessionFactory() as session:
+        values = dict(status='cancelled')
+        if scheduled:
+            # У запланированной рассылки нет координатора, который ее завершит
+            values['finished_at'] = datetime.now()
+        stmt = update(db.BroadcastJob).where(
+            db.BroadcastJob.id == job_id,
+            db.BroadcastJob.status == ('scheduled' if scheduled else 'running')
+        ).values(**values)
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount > 0
+
+async def finish_broadcast_job(job_id: int, status: str, success: int, failed: int):
+    """
+    Завершает задачу рассылки и сохраняет итоговые счетчики.
+    
+    Args:
+        job_id (int): ID задачи
+        status (str): Итоговый статус (completed / cancelled)
+        success (int): Количество успешных отправок
+        failed (int): Количество ошибок
+    """
+    async with AsyncSessionFactory() as session:
+        stmt = update(db.BroadcastJob).where(
+            db.BroadcastJob.id == job_id
+        ).values(
+            status=status,
+            success=success,
+            failed=failed,
+            owner=None,
+            lease_until=None,
+            finished_at=datetime.now()
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+async def add_broadcast_deliveries(rows: List[dict]):
+    """
+    Записывает пачку результатов доставки одним многострочным INSERT.
+    
+    Args:
+        rows (List[dict]): Строки broadcast_deliveries (job_id, user_pk, user_id, status, error, created_at)
+    """
+    if not rows:
+        return
+    async with AsyncSessionFactory() as session:
+        await session.execute(insert(db.BroadcastDelivery).values(rows))
+        await session.commit()
+
+async def get_user_broadcast_deliveries(user_id: int, limit: int = 20) -> List[db.BroadcastDelivery]:
+    """
+    Возвращает историю доставки рассылок пользователю, последние записи первыми.
+    
+    Args:
+        user_id (int): Telegram ID пользователя
+        limit (int): Максимальное количество записей
+        
+    Returns:
+        List[BroadcastDelivery]: Записи журнала доставки
+    """
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(db.BroadcastDelivery).where(
+                db.BroadcastDelivery.user_id == user_id
+            ).order_by(db.BroadcastDelivery.id.desc()).limit(limit)
+        )
+        return result.scalars().all()
+
+#Запросы для заявок на вступление
+async def upsert_join_requests(rows: List[dict]):
+    """
+    Сохраняет пачку заявок на вступление одним запросом.
+    Повторная заявка того же пользователя в тот же канал продлевает срок.
+    
+    Args:
+        rows (List[dict]): Строки join_requests (channel_id, user_id, created_at, expires_at)
+    """
+    if not rows:
+        return
+    async with AsyncSessionFactory() as session:
+        await session.execute(_upsert(db.JoinRequest, rows, ['created_at', 'expires_at']))
+        await session.commit()
+
+async def get_join_request_expiry(channel_id: int, user_id: int) -> Optional[datetime]:
+    """
+    Возвращает срок действующей заявки на вступление.
+    
+    Args:
+        channel_id (int): ID канала
+        user_id (int): Telegram ID пользователя
+        
+    Returns:
+        Optional[datetime]: Срок действия или None, если действующей заявки нет
+    """
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(db.JoinRequest.expires_at).where(
+                db.JoinRequest.channel_id == channel_id,
+                db.JoinRequest.user_id == user_id,
+                db.JoinRequest.expires_at > datetime.now()
+            )
+        )
+        return result.scalar_one_or_none()
+
+async def delete_expired_join_requests() -> int:
+    """
+    Удаляет истекшие заявки на вступление по индексу expires_at.
+    
+    Returns:
+        int: Количество удаленных заявок
+    """
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            delete(db.JoinRequest).where(db.JoinRequest.expires_at <= datetime.now())
+        )
+        await session.commit()
+        return result.rowcount
+
+#Запросы для проверки здоровья каналов
+async def get_channels_for_health_check() -> tuple:
+    """
+    Возвращает все активные ОП каналы и каналы заданий, включая помеченные сломанными,
+    чтобы фоновая проверка могла заметить их восстановление.
+    
+    Returns:
+        tuple: (список OPChannel, список Chanel)
+    """
+    async with AsyncSessionFactory() as session:
+        op_channels = await session.execute(
+            select(db.OPChannel).where(db.OPChannel.is_active == True, db.OPChannel.channel_id != 0)
+        )
+        task_channels = await session.execute(
+            select(db.Chanel).where(db.Chanel.is_active == True)
+        )
+        return op_channels.scalars().all(), task_channels.scalars().all()
+
+async def save_channel_health(model, channel_pk: int, status: str, error: Optional[str] = None,
+                              deactivate: bool = False):
+    """
+    Сохраняет результат фоновой проверки канала.
+    
+    Args:
+        model: db.OPChannel или db.Chanel
+        channel_pk (int): ID записи канала
+        status (str): ok / no_rights / not_found
+        error (Optional[str]): Текст ошибки Bot API
+        deactivate (bool): Отключить канал
+    """
+    values = dict(health_status=status, health_error=error[:255] if error else None,
+                  health_checked_at=datetime.now())
+    if deactivate:
+        values['is_active'] = False
+    async with AsyncSessionFactory() as session:
+        await session.execute(update(model).where(model.id == channel_pk).values(**values))
+        await session.commit()
+
+#Запросы для перепроверки выполненных заданий
+async def iter_completed_subscription_tasks(since: datetime, batch_size: int = 500) -> AsyncIterator[list]:
+    """
+    Обходит выполненные задания на подписку с keyset-пагинацией по user_tasks.id.
+    Пропускает задания, где отписка уже зафиксирована, и каналы, которые не найдены.
+    
+    Args:
+        since (datetime): Учитывать задания, выполненные не раньше этого времени
+        batch_size (int): Размер пачки
+        
+    Yields:
+        list: Пачка строк (id, user_id, chanel_id)
+    """
+    last_id = 0
+    while True:
+        async with AsyncSessionFactory() as session:
+            result = await session.execute(
+                select(db.UserTask.id, db.UserTask.user_id, db.Chanel.chanel_id).join(
+                    db.Chanel, db.Chanel.id == db.UserTask.task_id
+                ).where(
+                    db.UserTask.id > last_id,
+                    db.UserTask.completed == True,
+                    db.UserTask.completed_at >= since,
+                    db.UserTask.unsubscribed_at == None,
+                    db.Chanel.sab == True,
+                    _channel_healthy(db.Chanel)
+                ).order_by(db.UserTask.id).limit(batch_size)
+            )
+            rows = result.all()
+        
+        if not rows:
+            return
+        
+        last_id = rows[-1].id
+        yield rows
+        
+        if len(rows) < batch_size:
+            return
+
+async def mark_user_tasks_rechecked(verified_ids: List[int], unsubscribed_ids: List[int]):
+    """
+    Сохраняет результаты перепроверки пачки заданий двумя UPDATE.
+    
+    Args:
+        verified_ids (List[int]): user_tasks.id, где подписка подтверждена
+        unsubscribed_ids (List[int]): user_tasks.id, где пользователь отписался
+    """
+    if not verified_ids and not unsubscribed_ids:
+        return
+    now = datetime.now()
+    async with AsyncSessionFactory() as session:
+        if verified_ids:
+            await session.execute(
+                update(db.UserTask).where(db.UserTask.id.in_(verified_ids)).values(verified_at=now)
+            )
+        if unsubscribed_ids:
+            await session.execute(
+                update(db.UserTask).where(db.UserTask.id.in_(unsubscribed_ids)).values(
+                    verified_at=now, unsubscribed_at=now
+                )
+            )
+        await session.commit()
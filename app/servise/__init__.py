@@ -1,4 +1,4 @@
-from .subscribes_service import UserSubscribeService
+from .subscribes_service import UserSubscribeService, subscribes_service
  
-# Создаем глобальный экземпляр сервиса подписок
-subscribes_service = UserSubscribeService() 
\ No newline at end of file
+# Глобальный экземпляр сервиса подписок — тот же, что используют хендлеры
+__all__ = ['UserSubscribeService', 'subscribes_service']
@@ -1,20 +1,32 @@
-import logging
-from aiogram import Bot, types, F
 import asyncio
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+import logging
+import json
+from datetime import datetime
+from typing import Optional
+from aiogram import Bot, F
 from config import Config
 import app.database.db_queries as qu
 from aiogram import Router
 from aiogram.fsm.context import FSMContext
 from aiogram.filters.state import State, StatesGroup
-from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
-from datetime import datetime
+from .broadcast_jobs import (
+    active_senders, broadcast_worker, build_payload, make_send, payload_fields,
+    get_cancel_broadcast_progress_keyboard, get_progress_bar
+)
+from .broadcast_template import TEMPLATE_FIELDS
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 # Клавиатуры для рассылки
+def get_start_broadcast_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура первого шага рассылки"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🕒 Запланированные", callback_data="scheduled_broadcasts")],
+        [InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_broadcast_preview")]
+    ])
+
 def get_cancel_broadcast_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для отмены рассылки"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -24,33 +36,135 @@ def get_cancel_broadcast_keyboard() -> InlineKeyboardMarkup:
 def get_confirm_broadcast_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для подтверждения рассылки"""
     return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🎯 Аудитория", callback_data="broadcast_segment"),
+            InlineKeyboardButton(text="🕒 Запланировать", callback_data="broadcast_schedule")
+        ],
         [
             InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm_broadcast"),
             InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_broadcast_preview")
         ]
     ])
 
-def get_cancel_broadcast_progress_keyboard() -> InlineKeyboardMarkup:
-    """Клавиатура для отмены рассылки во время процесса"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Остановить рассылку", callback_data="cancel_broadcast_progress")]
-    ])
-
 class BroadcastStates(StatesGroup):
     waiting_for_message = State()
     waiting_for_confirmation = State()
+    waiting_for_segment = State()
+    waiting_for_schedule = State()
+
+SEGMENT_HELP = (
+    "🎯 <b>Выбор аудитории</b>\n\n"
+    "Отправьте фильтры, по одному в строке:\n"
+    "<code>op: да</code> — прошли ОП (да/нет)\n"
+    "<code>ref: КОД</code> — пришли по реферальной ссылке или от пользователя с этим ID\n"
+    "<code>с: 01.01.2025</code> — зарегистрированы начиная с даты\n"
+    "<code>по: 31.01.2025</code> — зарегистрированы до даты включительно\n"
+    "<code>баланс: 10</code> — баланс не меньше\n"
+    "<code>задания: 3</code> — выполнено заданий не меньше\n\n"
+    "Отправьте <code>все</code>, чтобы разослать всем пользователям."
+)
+
+def _parse_date(value: str) -> str:
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        raise ValueError(f"Неверная дата: {value}. Формат: ДД.ММ.ГГГГ")
+
+def _parse_number(value: str, kind, key: str):
+    try:
+        return kind(value.replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"Неверное значение для {key}: {value}")
+
+def parse_segment(text: str) -> Optional[dict]:
+    """
+    Разбирает фильтры аудитории, введенные админом.
+    
+    Args:
+        text (str): Текст с фильтрами, по одному в строке
+        
+    Returns:
+        Optional[dict]: Фильтры для qu.count_broadcast_recipients или None для всех пользователей
+        
+    Raises:
+        ValueError: Если фильтр не распознан
+    """
+    if text.strip().lower() == "все":
+        return None
+    
+    filters = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if ':' not in line:
+            raise ValueError(f"Не понимаю строку: {line}")
+        key, value = (part.strip() for part in line.split(':', 1))
+        key = key.lower()
+        if key == "op":
+            if value.lower() not in ("да", "нет"):
+                raise ValueError("Для op укажите да или нет")
+            filters['op_status'] = value.lower() == "да"
+        elif key == "ref":
+            filters['referred_by'] = value
+        elif key == "с":
+            filters['created_from'] = _parse_date(value)
+        elif key == "по":
+            filters['created_to'] = _parse_date(value)
+        elif key == "баланс":
+            filters['min_balans'] = _parse_number(value, float, key)
+        elif key == "задания":
+            filters['min_tasks'] = _parse_number(value, int, key)
+        else:
+            raise ValueError(f"Неизвестный фильтр: {key}")
+    return filters or None
+
+def describe_segment(filters: Optional[dict]) -> str:
+    """Описание аудитории для предпросмотра"""
+    if not filters:
+        return "все пользователи"
+    parts = []
+    if filters.get('op_status') is not None:
+        parts.append("прошли ОП" if filters['op_status'] else "не прошли ОП")
+    if filters.get('referred_by'):
+        parts.append(f"реферал {filters['referred_by']}")
+    if filters.get('created_from'):
+        parts.append(f"с {filters['created_from']}")
+    if filters.get('created_to'):
+        parts.append(f"по {filters['created_to']}")
+    if filters.get('min_balans') is not None:
+        parts.append(f"баланс ≥ {filters['min_balans']}")
+    if filters.get('min_tasks'):
+        parts.append(f"заданий ≥ {filters['min_tasks']}")
+    if filters.get('failed_in_job'):
+        parts.append(f"не получили рассылку #{filters['failed_in_job']}")
+    return ", ".join(parts)
+
+async def send_broadcast_preview(message: Message, state: FSMContext):
+    """Показывает предпросмотр с точным количеством получателей"""
+    data = await state.get_data()
+    filters = data.get('filters')
+    recipients = await qu.count_broadcast_recipients(filters)
+    
+    preview_text = "📢 <b>Предпросмотр сообщения для рассылки</b>\n\n"
+    preview_text += f"🎯 Аудитория: {describe_segment(filters)}\n"
+    preview_text += f"👥 Получателей: {recipients}\n"
+    fields = payload_fields(json.loads(data['payload'])) if data.get('payload') else []
+    if fields:
+        preview_text += f"🧩 Персонализация: {', '.join('{' + field + '}' for field in fields)}\n"
+    preview_text += "\n"
+    preview_text += "Подтвердите или отмените рассылку:"
+    
+    await message.answer(
+        preview_text,
+        reply_markup=get_confirm_broadcast_keyboard(),
+        parse_mode="HTML"
+    )
+    await state.set_state(BroadcastStates.waiting_for_confirmation)
 
-# Глобальные переменные для отслеживания рассылки
-broadcast_in_progress = False
-broadcast_cancelled = False
-broadcast_stats = {
-    'total': 0,
-    'success': 0,
-    'failed': 0,
-    'start_time': None,
-    'end_time': None
-}
-broadcast_message = None  # Сохраняем сообщение для рассылки
+# Сколько ждать остальные сообщения альбома, секунд
+ALBUM_COLLECT_DELAY = 1.0
+# Собираемые альбомы: {media_group_id: [message_id, ...]}
+_album_buffers: dict = {}
 
 @router.callback_query(F.data == "broadcast")
 async def start_broadcast(callback: CallbackQuery, state: FSMContext):
@@ -59,7 +173,7 @@ async def start_broadcast(callback: CallbackQuery, state: FSMContext):
         await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
         return
     
-    if broadcast_in_progress:
+    if await qu.get_unfinished_broadcast_jobs():
         await callback.answer("❌ Рассылка уже в процессе", show_alert=True)
         return
     
@@ -68,85 +182,101 @@ async def start_broadcast(callback: CallbackQuery, state: FSMContext):
         "📢 <b>Отправьте сообщение для рассылки</b>\n\n"
         "Вы можете отправить:\n"
         "• Текст с форматированием\n"
-        "• Фото с текстом\n"
+        "• Фото, видео, документ или GIF с текстом\n"
+        "• Альбом\n"
         "• Кнопки\n\n"
-        "Сообщение будет отправлено всем пользователям бота.",
-        reply_markup=get_cancel_broadcast_keyboard(),
+        "Подстановки в тексте: "
+        + ", ".join(f"<code>{{{field}}}</code> — {description}" for field, description in TEMPLATE_FIELDS.items())
+        + "\n\n"
+        "Аудиторию и время отправки можно будет выбрать на следующем шаге.",
+        reply_markup=get_start_broadcast_keyboard(),
         parse_mode="HTML"
     )
 
 @router.message(BroadcastStates.waiting_for_message)
 async def process_broadcast_message(message: Message, state: FSMContext, bot: Bot):
     """Обработка сообщения для рассылки"""
-    global broadcast_message
-    
     if message.from_user.id not in Config.ADMIN_IDS:
         return
     
-    # Сохраняем сообщение для рассылки
-    broadcast_message = message
+    message_ids = None
+    if message.media_group_id:
+        # Сообщения альбома приходят отдельными апдейтами: первое собирает остальные
+        album = _album_buffers.setdefault(message.media_group_id, [])
+        album.append(message.message_id)
+        if len(album) > 1:
+            return
+        await asyncio.sleep(ALBUM_COLLECT_DELAY)
+        message_ids = sorted(_album_buffers.pop(message.media_group_id))
     
-    # Сначала отправляем само сообщение для рассылки
-    if message.photo:
-        await message.answer_photo(
-            message.photo[-1].file_id,
-            caption=message.html_text if message.caption_entities else message.caption,
-            reply_markup=message.reply_markup,
-            parse_mode="HTML" if message.caption_entities else None
-        )
+    # Сохраняем содержимое рассылки в состоянии, а не в глобальных переменных
+    payload = build_payload(message, message_ids)
+    await state.update_data(payload=payload, filters=None)
+    
+    # Сначала отправляем само сообщение для рассылки, подстановки — по данным админа
+    payload_data = json.loads(payload)
+    fields = payload_fields(payload_data)
+    send = make_send(bot, payload_data)
+    if fields:
+        await send(message.chat.id, await qu.get_user_template_values(message.from_user.id, fields))
     else:
-        await message.answer(
-            message.html_text if message.entities else message.text,
-            reply_markup=message.reply_markup,
-            parse_mode="HTML" if message.entities else None
-        )
+        await send(message.chat.id)
     
     # Затем отправляем предпросмотр сообщения
-    preview_text = "📢 <b>Предпросмотр сообщения для рассылки</b>\n\n"
-    preview_text += "Сообщение будет отправлено всем пользователям бота.\n"
-    preview_text += "Подтвердите или отмените рассылку:"
+    await send_broadcast_preview(message, state)
+
+@router.callback_query(F.data == "broadcast_segment", BroadcastStates.waiting_for_confirmation)
+async def start_broadcast_segment(callback: CallbackQuery, state: FSMContext):
+    """Переход к выбору аудитории рассылки"""
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
+        return
     
-    await message.answer(
-        preview_text,
-        reply_markup=get_confirm_broadcast_keyboard(),
+    await state.set_state(BroadcastStates.waiting_for_segment)
+    await callback.message.edit_text(
+        SEGMENT_HELP,
+        reply_markup=get_cancel_broadcast_keyboard(),
         parse_mode="HTML"
     )
+
+@router.message(BroadcastStates.waiting_for_segment)
+async def process_broadcast_segment(message: Message, state: FSMContext):
+    """Обработка фильтров аудитории"""
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
     
-    await state.set_state(BroadcastStates.waiting_for_confirmation)
+    try:
+        filters = parse_segment(message.text or "")
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n\nПопробуйте еще раз:", reply_markup=get_cancel_broadcast_keyboard())
+        return
+    
+    await state.update_data(filters=filters)
+    await send_broadcast_preview(message, state)
 
 @router.callback_query(F.data == "confirm_broadcast")
 async def confirm_broadcast(callback: CallbackQuery, state: FSMContext, bot: Bot):
     """Подтверждение рассылки"""
-    global broadcast_in_progress, broadcast_cancelled, broadcast_stats, broadcast_message
-    
     if callback.from_user.id not in Config.ADMIN_IDS:
         await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
         return
     
-    if not broadcast_message:
+    data = await state.get_data()
+    payload = data.get('payload')
+    filters = data.get('filters')
+    if not payload:
         await callback.answer("❌ Сообщение для рассылки не найдено", show_alert=True)
         return
     
-    # Получаем всех пользователей
-    users = await qu.get_all_users()
-    total_users = len(users)
+    # Считаем получателей без загрузки строк, сами ID читаются потоком при отправке
+    total_users = await qu.count_broadcast_recipients(filters)
     
     if total_users == 0:
         await callback.message.answer("❌ Нет пользователей для рассылки")
         await state.clear()
         return
     
-    # Инициализируем статистику
-    broadcast_stats = {
-        'total': total_users,
-        'success': 0,
-        'failed': 0,
-        'start_time': datetime.now(),
-        'end_time': None
-    }
-    
-    broadcast_in_progress = True
-    broadcast_cancelled = False
+    await state.clear()
     
     # Создаем сообщение со статистикой
     stats_message = await callback.message.answer(
@@ -156,80 +286,190 @@ async def confirm_broadcast(callback: CallbackQuery, state: FSMContext, bot: Bot
         f"✅ Успешно: 0\n"
         f"❌ Ошибок: 0\n"
         f"⏱ Время: 0 сек",
-        reply_markup=get_cancel_broadcast_progress_keyboard(),
         parse_mode="HTML"
     )
     
-    # Отправляем сообщение всем пользователям
-    for i, user in enumerate(users, 1):
-        if broadcast_cancelled:
-            break
-            
-        try:
-            # Копируем сообщение с сохранением форматирования
-            if broadcast_message.photo:
-                await bot.send_photo(
-                    user.user_id,
-                    broadcast_message.photo[-1].file_id,
-                    caption=broadcast_message.html_text if broadcast_message.caption_entities else broadcast_message.caption,
-                    parse_mode="HTML" if broadcast_message.caption_entities else None,
-                    reply_markup=broadcast_message.reply_markup
-                )
-            else:
-                # Проверяем наличие форматирования в тексте
-                parse_mode = "HTML" if broadcast_message.entities else None
-                await bot.send_message(
-                    user.user_id,
-                    broadcast_message.html_text if broadcast_message.entities else broadcast_message.text,
-                    parse_mode=parse_mode,
-                    reply_markup=broadcast_message.reply_markup
-                )
-            broadcast_stats['success'] += 1
-        except Exception as e:
-            logger.error(f"Failed to send broadcast to user {user.user_id}: {e}")
-            broadcast_stats['failed'] += 1
-        
-        # Обновляем статистику каждые 10 сообщений или в конце
-        if i % 10 == 0 or i == total_users:
-            elapsed_time = (datetime.now() - broadcast_stats['start_time']).total_seconds()
-            await stats_message.edit_text(
-                f"📊 <b>Рассылка в процессе</b>\n\n"
-                f"👥 Всего пользователей: {total_users}\n"
-                f"⏳ Прогресс: {get_progress_bar(i, total_users)}\n"
-                f"✅ Успешно: {broadcast_stats['success']}\n"
-                f"❌ Ошибок: {broadcast_stats['failed']}\n"
-                f"⏱ Время: {int(elapsed_time)} сек",
-                reply_markup=get_cancel_broadcast_progress_keyboard(),
-                parse_mode="HTML"
-            )
-        
-        # Небольшая задержка между сообщениями
-        await asyncio.sleep(0.1)
+    # Сохраняем задачу в БД: ее подхватят воркеры всех запущенных процессов бота
+    job_id = await qu.create_broadcast_job(
+        payload, total_users, callback.from_user.id,
+        stats_message.chat.id, stats_message.message_id,
+        filters
+    )
+    await stats_message.edit_reply_markup(
+        reply_markup=get_cancel_broadcast_progress_keyboard(job_id)
+    )
     
-    # Завершаем рассылку
-    broadcast_in_progress = False
-    broadcast_stats['end_time'] = datetime.now()
-    total_time = (broadcast_stats['end_time'] - broadcast_stats['start_time']).total_seconds()
+    broadcast_worker.wake()
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("retry_broadcast_failed:"))
+async def retry_broadcast_failed(callback: CallbackQuery):
+    """Повторная рассылка тем, кому сообщение не дошло, по журналу доставки"""
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
+        return
     
-    if broadcast_cancelled:
-        final_message = "❌ Рассылка отменена"
-    else:
-        final_message = "✅ Рассылка завершена"
+    if await qu.get_unfinished_broadcast_jobs():
+        await callback.answer("❌ Рассылка уже в процессе", show_alert=True)
+        return
     
-    await stats_message.edit_text(
-        f"{final_message}\n\n"
-        f"📊 <b>Итоговая статистика</b>\n\n"
+    job_id = int(callback.data.split(":")[1])
+    job = await qu.get_broadcast_job(job_id)
+    if not job:
+        await callback.answer("❌ Рассылка не найдена", show_alert=True)
+        return
+    
+    filters = {'failed_in_job': job_id}
+    total_users = await qu.count_broadcast_recipients(filters)
+    if total_users == 0:
+        await callback.answer("✅ Нет получателей для повторной отправки", show_alert=True)
+        return
+    
+    await callback.message.edit_reply_markup(reply_markup=None)
+    stats_message = await callback.message.answer(
+        f"📊 <b>Повторная рассылка #{job_id}</b>\n\n"
         f"👥 Всего пользователей: {total_users}\n"
-        f"✅ Успешно: {broadcast_stats['success']}\n"
-        f"❌ Ошибок: {broadcast_stats['failed']}\n"
-        f"⏱ Общее время: {int(total_time)} сек\n"
-        f"📈 Процент доставки: {broadcast_stats['success'] / total_users * 100:.1f}%",
-        reply_markup=None,
+        f"⏳ Прогресс: {get_progress_bar(0, total_users)}",
+        parse_mode="HTML"
+    )
+    retry_job_id = await qu.create_broadcast_job(
+        job.payload, total_users, callback.from_user.id,
+        stats_message.chat.id, stats_message.message_id,
+        filters
+    )
+    await stats_message.edit_reply_markup(
+        reply_markup=get_cancel_broadcast_progress_keyboard(retry_job_id)
+    )
+    
+    broadcast_worker.wake()
+    await callback.answer()
+
+@router.callback_query(F.data == "broadcast_schedule", BroadcastStates.waiting_for_confirmation)
+async def start_broadcast_schedule(callback: CallbackQuery, state: FSMContext):
+    """Переход к выбору времени отложенной рассылки"""
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
+        return
+    
+    await state.set_state(BroadcastStates.waiting_for_schedule)
+    await callback.message.edit_text(
+        "🕒 <b>Отложенная рассылка</b>\n\n"
+        "Отправьте дату и время запуска в формате <code>ДД.ММ.ГГГГ ЧЧ:ММ</code> (время сервера).\n"
+        f"Сейчас: <code>{datetime.now().strftime('%d.%m.%Y %H:%M')}</code>",
+        reply_markup=get_cancel_broadcast_keyboard(),
         parse_mode="HTML"
     )
+
+@router.message(BroadcastStates.waiting_for_schedule)
+async def process_broadcast_schedule(message: Message, state: FSMContext):
+    """Сохранение отложенной рассылки"""
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+    
+    try:
+        scheduled_at = datetime.strptime((message.text or "").strip(), "%d.%m.%Y %H:%M")
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат. Пример: <code>31.12.2025 03:00</code>",
+            reply_markup=get_cancel_broadcast_keyboard(),
+            parse_mode="HTML"
+        )
+        return
+    
+    if scheduled_at <= datetime.now():
+        await message.answer(
+            "❌ Время запуска должно быть в будущем",
+            reply_markup=get_cancel_broadcast_keyboard()
+        )
+        return
+    
+    data = await state.get_data()
+    payload = data.get('payload')
+    filters = data.get('filters')
+    if not payload:
+        await message.answer("❌ Сообщение для рассылки не найдено")
+        await state.clear()
+        return
     
     await state.clear()
-    broadcast_message = None
+    
+    # Это сообщение станет сообщением прогресса, когда рассылка запустится
+    status_message = await message.answer(
+        f"🕒 <b>Рассылка запланирована</b>\n\n"
+        f"📅 Запуск: {scheduled_at.strftime('%d.%m.%Y %H:%M')}\n"
+        f"🎯 Аудитория: {describe_segment(filters)}",
+        parse_mode="HTML"
+    )
+    job_id = await qu.create_broadcast_job(
+        payload, 0, message.from_user.id,
+        status_message.chat.id, status_message.message_id,
+        filters, scheduled_at=scheduled_at
+    )
+    await status_message.edit_reply_markup(
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отменить рассылку", callback_data=f"cancel_scheduled_broadcast:{job_id}")]
+        ])
+    )
+
+@router.callback_query(F.data == "scheduled_broadcasts")
+async def show_scheduled_broadcasts(callback: CallbackQuery, state: FSMContext):
+    """Список запланированных рассылок"""
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
+        return
+    
+    await state.clear()
+    jobs = await qu.get_scheduled_broadcast_jobs()
+    if not jobs:
+        await callback.answer("📭 Запланированных рассылок нет", show_alert=True)
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton(
+            text=f"❌ #{job.id} — {job.scheduled_at.strftime('%d.%m.%Y %H:%M')}",
+            callback_data=f"cancel_scheduled_broadcast:{job.id}"
+        )]
+        for job in jobs
+    ]
+    await callback.message.edit_text(
+        "🕒 <b>Запланированные рассылки</b>\n\n"
+        "Нажмите на рассылку, чтобы отменить ее:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+        parse_mode="HTML"
+    )
+
+@router.callback_query(F.data.startswith("cancel_scheduled_broadcast:"))
+async def cancel_scheduled_broadcast(callback: CallbackQuery):
+    """Отмена запланированной рассылки"""
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
+        return
+    
+    job_id = int(callback.data.split(":")[1])
+    if not await qu.cancel_broadcast_job(job_id, scheduled=True):
+        await callback.answer("❌ Рассылка уже запущена или отменена", show_alert=True)
+        return
+    
+    await callback.answer(f"✅ Рассылка #{job_id} отменена", show_alert=True)
+    await callback.message.edit_reply_markup(reply_markup=None)
+
+@router.callback_query(F.data.startswith("cancel_broadcast_progress:"))
+async def cancel_broadcast_progress(callback: CallbackQuery):
+    """Остановка рассылки во время отправки"""
+    if callback.from_user.id not in Config.ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав для выполнения этого действия", show_alert=True)
+        return
+
+    job_id = int(callback.data.split(":")[1])
+    if not await qu.cancel_broadcast_job(job_id):
+        await callback.answer("❌ Нет активной рассылки", show_alert=True)
+        return
+
+    # Воркеры других процессов остановятся при ближайшем продлении аренды
+    sender = active_senders.get(job_id)
+    if sender:
+        sender.cancel()
+    await callback.answer("⏹ Рассылка останавливается...")
 
 @router.callback_query(F.data == "cancel_broadcast_preview")
 async def cancel_broadcast_preview(callback: CallbackQuery, state: FSMContext):
@@ -243,21 +483,3 @@ async def cancel_broadcast_preview(callback: CallbackQuery, state: FSMContext):
         reply_markup=None
     )
     await state.clear()
-    broadcast_message = None
-
-def get_progress_bar(current: int, total: int, width: int = 20) -> str:
-    """
-    Создает визуальный индикатор прогресса.
-    
-    Args:
-        current (int): Текущее значение
-        total (int): Общее значение
-        width (int): Ширина индикатора
-        
-    Returns:
-        str: Строка с индикатором прогресса
-    """
-    progress = int(width * current / total)
-    bar = "█" * progress + "░" * (width - progress)
-    percentage = current / total * 100
-    return f"{bar} {percentage:.1f}%" 
\ No newline at end of file
@@ -0,0 +1,514 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import CopyMessage, CopyMessages, SendMessage, SendPhoto, TelegramMethod
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+import app.database.db_queries as qu
+from config import Config
+from app.database.database import BroadcastJob, BroadcastShard
+from .broadcast_sender import BroadcastSender
+from .delivery_log import DeliveryLogWriter
+from .broadcast_template import compile_template, find_template_fields
+
+logger = logging.getLogger(__name__)
+
+# Диапазоны рассылок, которые сейчас отправляет этот процесс: {job_id: BroadcastSender}
+active_senders: dict = {}
+
+
+def get_cancel_broadcast_progress_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура для отмены рассылки во время процесса"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Остановить рассылку", callback_data=f"cancel_broadcast_progress:{job_id}")]
+    ])
+
+
+def get_retry_broadcast_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура для повторной отправки тем, кому рассылка не дошла"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔁 Повторить для неудачных", callback_data=f"retry_broadcast_failed:{job_id}")]
+    ])
+
+
+def get_progress_bar(current: int, total: int, width: int = 20) -> str:
+    """
+    Создает визуальный индикатор прогресса.
+
+    Args:
+        current (int): Текущее значение
+        total (int): Общее значение
+        width (int): Ширина индикатора
+
+    Returns:
+        str: Строка с индикатором прогресса
+    """
+    if total <= 0:
+        return "░" * width + " 0.0%"
+    current = min(current, total)
+    progress = int(width * current / total)
+    bar = "█" * progress + "░" * (width - progress)
+    percentage = current / total * 100
+    return f"{bar} {percentage:.1f}%"
+
+
+def build_payload(message: Message, message_ids: Optional[List[int]] = None) -> str:
+    """
+    Сериализует сообщение админа в JSON для хранения в задаче рассылки.
+
+    Сохраняется только ссылка на исходное сообщение: при рассылке оно копируется
+    через copy_message, поэтому поддерживаются любые типы контента
+    (текст, фото, видео, документы, анимации, альбомы) без повторной загрузки.
+
+    Если в тексте или подписи есть подстановки вида {balans}, сохраняется
+    HTML-шаблон: текст отправляется через send_message, медиа копируется
+    с подменой подписи. В альбомах подстановки не поддерживаются.
+
+    Args:
+        message (Message): Сообщение для рассылки
+        message_ids (Optional[List[int]]): ID сообщений альбома, если это альбом
+
+    Returns:
+        str: JSON с содержимым сообщения
+    """
+    payload = {
+        'type': 'copy',
+        'from_chat_id': message.chat.id,
+        'message_ids': message_ids or [message.message_id],
+        'reply_markup': (
+            message.reply_markup.model_dump(exclude_none=True) if message.reply_markup else None
+        ),
+    }
+    fields = find_template_fields(message.html_text) if not message_ids else []
+    if fields:
+        payload['template'] = {
+            'text': message.html_text,
+            'fields': fields,
+            'media': message.text is None,
+        }
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def payload_fields(payload: dict) -> List[str]:
+    """Поля для персонализации, которые нужно читать вместе с получателями"""
+    return payload.get('template', {}).get('fields', [])
+
+
+def compile_payload(payload: dict) -> TelegramMethod:
+    """
+    Один раз собирает готовый к отправке запрос к Bot API.
+    Для каждого получателя меняется только chat_id.
+
+    Args:
+        payload (dict): Содержимое рассылки
+
+    Returns:
+        TelegramMethod: Шаблон запроса
+    """
+    reply_markup = (
+        InlineKeyboardMarkup.model_validate(payload['reply_markup'])
+        if payload.get('reply_markup') else None
+    )
+
+    template = payload.get('template')
+    if template and not template['media']:
+        # Текст отрисовывается заново для каждого получателя
+        return SendMessage(
+            chat_id=0,
+            text=template['text'],
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+    if template:
+        return CopyMessage(
+            chat_id=0,
+            from_chat_id=payload['from_chat_id'],
+            message_id=payload['message_ids'][0],
+            caption=template['text'],
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+
+    if payload['type'] == 'copy':
+        message_ids = payload['message_ids']
+        if len(message_ids) > 1:
+            # Альбом копируется одним запросом, кнопки к альбому не прикрепляются
+            return CopyMessages(
+                chat_id=0,
+                from_chat_id=payload['from_chat_id'],
+                message_ids=message_ids
+            )
+        return CopyMessage(
+            chat_id=0,
+            from_chat_id=payload['from_chat_id'],
+            message_id=message_ids[0],
+            reply_markup=reply_markup
+        )
+
+    # Задачи, созданные до перехода на copy_message
+    if payload['type'] == 'photo':
+        return SendPhoto(
+            chat_id=0,
+            photo=payload['file_id'],
+            caption=payload['text'],
+            parse_mode=payload['parse_mode'],
+            reply_markup=reply_markup
+        )
+    return SendMessage(
+        chat_id=0,
+        text=payload['text'],
+        parse_mode=payload['parse_mode'],
+        reply_markup=reply_markup
+    )
+
+
+def make_send(bot: Bot, payload: dict):
+    """
+    Создает корутину отправки заранее собранного запроса одному получателю.
+    Шаблон персонализации разбирается здесь один раз на всю рассылку.
+    """
+    method = compile_payload(payload)
+    template = payload.get('template')
+    if not template:
+        async def send(chat_id: int):
+            await bot(method.model_copy(update={'chat_id': chat_id}))
+
+        return send
+
+    render = compile_template(template['text'])
+    text_field = 'caption' if template['media'] else 'text'
+
+    async def send_personalized(chat_id: int, values: Optional[dict] = None):
+        await bot(method.model_copy(update={'chat_id': chat_id, text_field: render(values or {})}))
+
+    return send_personalized
+
+
+def job_filters(job: BroadcastJob) -> Optional[dict]:
+    """Фильтры аудитории задачи рассылки"""
+    return json.loads(job.filters) if job.filters else None
+
+
+async def _edit_status(bot: Bot, job: BroadcastJob, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Обновляет сообщение с прогрессом рассылки"""
+    if not job.status_chat_id or not job.status_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=job.status_chat_id,
+            message_id=job.status_message_id,
+            reply_markup=reply_markup,
+            parse_mode="HTML"
+        )
+    except TelegramBadRequest as e:
+        # Текст не изменился или сообщение удалено — прогресс не критичен
+        logger.debug(f"Не удалось обновить прогресс рассылки {job.id}: {e}")
+
+
+def _format_duration(seconds: float) -> str:
+    """Форматирует длительность в читаемый вид"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours} ч {minutes:02d} мин"
+    if minutes:
+        return f"{minutes} мин {seconds:02d} сек"
+    return f"{seconds} сек"
+
+
+class BroadcastProgressReporter:
+    """
+    Сообщение с прогрессом рассылки. Координатор рассылки вызывает report()
+    после каждого сбора счетчиков со всех диапазонов (раз в
+    BROADCAST_PROGRESS_INTERVAL). Отправку сообщений это не задерживает:
+    координатор работает отдельно от воркеров, которые отправляют рассылку.
+    Текущая скорость считается по изменению счетчиков между вызовами.
+
+    Args:
+        bot (Bot): Экземпляр бота
+        job (BroadcastJob): Задача рассылки
+        snapshot (Callable[[], dict]): Текущие счетчики: done, success, failed, unreachable, elapsed, throughput
+    """
+
+    def __init__(self, bot: Bot, job: BroadcastJob, snapshot: Callable[[], dict]):
+        self.bot = bot
+        self.job = job
+        self._snapshot = snapshot
+        self._last_done: Optional[int] = None
+        self._last_time: Optional[float] = None
+
+    async def report(self):
+        """Обновляет сообщение с прогрессом: текущая скорость считается по изменению с прошлого вызова"""
+        stats = self._snapshot()
+        done = stats['done']
+        total = self.job.total
+        now = time.monotonic()
+
+        if self._last_time is not None and now > self._last_time:
+            speed = (done - self._last_done) / (now - self._last_time)
+        else:
+            speed = stats['throughput']
+        self._last_done, self._last_time = done, now
+
+        remaining = max(total - done, 0)
+        eta = _format_duration(remaining / speed) if speed > 0 else "—"
+
+        await _edit_status(
+            self.bot, self.job,
+            f"📊 <b>Рассылка в процессе</b>\n\n"
+            f"👥 Всего пользователей: {total}\n"
+            f"⏳ Прогресс: {get_progress_bar(done, total)}\n"
+            f"✅ Успешно: {stats['success']}\n"
+            f"❌ Ошибок: {stats['failed']}\n"
+            f"🚫 Заблокировали бота: {stats['unreachable']}\n"
+            f"🚀 Скорость: {speed:.1f} сообщ/с\n"
+            f"⏱ Время: {_format_duration(stats['elapsed'])}\n"
+            f"⌛ Осталось: {eta}",
+            reply_markup=get_cancel_broadcast_progress_keyboard(self.job.id)
+        )
+
+
+class BroadcastWorker:
+    """
+    Фоновый воркер рассылок. Каждый процесс бота запускает свой экземпляр.
+
+    Рассылка разбита на диапазоны users.id (broadcast_shards). Воркер захватывает
+    свободный диапазон в аренду через БД, отправляет сообщения и продлевает аренду
+    вместе с чекпоинтом. Если процесс упал, аренда истекает и диапазон подхватывает
+    другой воркер с сохраненного чекпоинта. Общий лимит скорости делится поровну
+    между воркерами, которые сейчас держат аренду.
+
+    Один из процессов дополнительно берет аренду координатора задачи: он обновляет
+    сообщение с прогрессом и завершает рассылку, когда все диапазоны обработаны.
+
+    Тот же цикл служит планировщиком: отложенные рассылки из БД запускаются,
+    когда наступает их время, и дальше идут общим путем.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._shard_task: Optional[asyncio.Task] = None
+        self._coordinators: dict = {}  # {job_id: asyncio.Task}
+        self._wakeup = asyncio.Event()
+
+    async def start(self, bot: Bot):
+        """Запускает цикл поиска рассылок"""
+        if self._task is None:
+            self.bot = bot
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"Воркер рассылок {self.worker_id} запущен")
+
+    async def stop(self):
+        """Останавливает воркер. Незавершенные диапазоны подхватят после истечения аренды"""
+        tasks = [self._task, self._shard_task, *self._coordinators.values()]
+        for task in tasks:
+            if task and not task.done():
+                task.cancel()
+        for task in tasks:
+            if task:
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = None
+        self._shard_task = None
+        self._coordinators.clear()
+
+    def wake(self):
+        """Будит воркер, не дожидаясь следующего опроса (например, после создания рассылки)"""
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._tick()
+            except Exception as e:
+                logger.error(f"Ошибка в цикле воркера рассылок: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=Config.BROADCAST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _tick(self):
+        # Планировщик: запускаем отложенные рассылки, время которых наступило
+        for job_id in await qu.activate_due_broadcast_jobs():
+            logger.info(f"Запущена запланированная рассылка {job_id}")
+
+        jobs = await qu.get_unfinished_broadcast_jobs()
+
+        for job in jobs:
+            task = self._coordinators.get(job.id)
+            if task and not task.done():
+                continue
+            if await qu.claim_broadcast_job_lease(job.id, self.worker_id, Config.BROADCAST_LEASE_SECONDS):
+                self._coordinators[job.id] = self._spawn(self._coordinate(job))
+
+        # Каждый процесс обрабатывает по одному диапазону за раз
+        if self._shard_task and not self._shard_task.done():
+            return
+        for job in jobs:
+            shard = await qu.claim_broadcast_shard(job.id, self.worker_id, Config.BROADCAST_LEASE_SECONDS)
+            if shard:
+                self._shard_task = self._spawn(self._run_shard(job, shard))
+                return
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+
+        def on_done(t: asyncio.Task):
+            if not t.cancelled() and t.exception():
+                logger.error(f"Задача рассылки завершилась с ошибкой: {t.exception()}")
+            # Сразу ищем следующий диапазон
+            self.wake()
+
+        task.add_done_callback(on_done)
+        return task
+
+    async def _run_shard(self, job: BroadcastJob, shard: BroadcastShard):
+        """Отправляет рассылку по одному диапазону users.id"""
+        payload = json.loads(job.payload)
+        send = make_send(self.bot, payload)
+        base_success, base_failed, base_unreachable = shard.success or 0, shard.failed or 0, shard.unreachable or 0
+        delivery_log = DeliveryLogWriter(job.id)
+
+        async def save_checkpoint(checkpoint: int, counts: Tuple[int, int, int]):
+            # Недоступных пользователей и журнал пишем до чекпоинта, чтобы не потерять их при сбое
+            await qu.mark_users_unreachable(sender.drain_unreachable())
+            await delivery_log.flush()
+            # Счетчики только до чекпоинта: получателей после него продолжение отправит заново
+            success, failed, unreachable = counts
+            still_owner = await qu.update_broadcast_shard_progress(
+                shard.id, self.worker_id, checkpoint,
+                base_success + success,
+                base_failed + failed,
+                base_unreachable + unreachable,
+                Config.BROADCAST_LEASE_SECONDS
+            )
+            if not still_owner:
+                logger.warning(f"Аренда диапазона {shard.id} рассылки {job.id} потеряна, останавливаемся")
+                sender.cancel()
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(Config.BROADCAST_LEASE_SECONDS / 3)
+                current = await qu.get_broadcast_job(job.id)
+                if not current or current.status != 'running':
+                    sender.cancel()
+                    return
+                workers = await qu.count_active_broadcast_workers()
+                sender.bucket.rate = Config.BROADCAST_RATE / max(workers, 1)
+                await sender.flush_checkpoint()
+
+        sender = BroadcastSender(
+            send,
+            rate=Config.BROADCAST_RATE / max(await qu.count_active_broadcast_workers(), 1),
+            on_checkpoint=save_checkpoint,
+            start_pk=shard.checkpoint_pk,
+            on_result=delivery_log.add
+        )
+        active_senders[job.id] = sender
+        delivery_log.start()
+        heartbeat_task = asyncio.create_task(heartbeat())
+        logger.info(f"Рассылка {job.id}: диапазон {shard.id} (users.id {shard.checkpoint_pk}..{shard.end_pk})")
+        try:
+            await sender.run(qu.iter_users(
+                after_id=shard.checkpoint_pk, until_id=shard.end_pk, filters=job_filters(job),
+                fields=payload_fields(payload)
+            ))
+        finally:
+            heartbeat_task.cancel()
+            active_senders.pop(job.id, None)
+            await delivery_log.close()
+
+        if not sender.cancelled:
+            # Все пачки завершены, поэтому счетчики до чекпоинта охватывают весь диапазон
+            success, failed, unreachable = sender.checkpoint_counts
+            await qu.update_broadcast_shard_progress(
+                shard.id, self.worker_id, shard.end_pk,
+                base_success + success,
+                base_failed + failed,
+                base_unreachable + unreachable,
+                Config.BROADCAST_LEASE_SECONDS,
+                done=True
+            )
+
+    async def _coordinate(self, job: BroadcastJob):
+        """Обновляет прогресс рассылки по данным всех воркеров и завершает ее"""
+        await qu.ensure_broadcast_shards(job.id, job.last_user_pk or 0, job_filters(job))
+        # Счетчики, накопленные задачей до разбиения на диапазоны
+        base_success, base_failed = job.success or 0, job.failed or 0
+        started = job.started_at or job.created_at or datetime.now()
+        stats: dict = {}
+
+        def snapshot() -> dict:
+            return stats
+
+        reporter = BroadcastProgressReporter(self.bot, job, snapshot)
+
+        while True:
+            await asyncio.sleep(Config.BROADCAST_PROGRESS_INTERVAL)
+            totals = await qu.get_broadcast_job_totals(job.id)
+            success = base_success + totals['success']
+            failed = base_failed + totals['failed']
+            elapsed = (datetime.now() - started).total_seconds()
+            stats.update(
+                done=success + failed,
+                success=success,
+                failed=failed,
+                unreachable=totals['unreachable'],
+                elapsed=elapsed,
+                throughput=(success + failed) / elapsed if elapsed > 0 else 0.0
+            )
+
+            if not await qu.claim_broadcast_job_lease(job.id, self.worker_id, Config.BROADCAST_LEASE_SECONDS):
+                current = await qu.get_broadcast_job(job.id)
+                if current and current.status == 'cancelled' and not current.finished_at:
+                    await self._finish(job, 'cancelled', stats)
+                return
+
+            if totals['done_shards'] >= totals['shards']:
+                await self._finish(job, 'completed', stats)
+                return
+
+            await reporter.report()
+
+    async def _finish(self, job: BroadcastJob, status: str, stats: dict):
+        await qu.finish_broadcast_job(job.id, status, stats['success'], stats['failed'])
+        total = job.total
+        final_message = "❌ Рассылка отменена" if status == 'cancelled' else "✅ Рассылка завершена"
+        await _edit_status(
+            self.bot, job,
+            f"{final_message}\n\n"
+            f"📊 <b>Итоговая статистика</b>\n\n"
+            f"👥 Всего пользователей: {total}\n"
+            f"✅ Успешно: {stats['success']}\n"
+            f"❌ Ошибок: {stats['failed']}\n"
+            f"🚫 Исключено заблокировавших бота: {stats['unreachable']}\n"
+            f"⏱ Общее время: {_format_duration(stats['elapsed'])}\n"
+            f"🚀 Средняя скорость: {stats['throughput']:.1f} сообщ/с\n"
+            f"📈 Процент доставки: {stats['success'] / total * 100 if total else 0:.1f}%",
+            # Заблокировавшим бота повторять бессмысленно, они уже исключены из рассылок
+            reply_markup=(
+                get_retry_broadcast_keyboard(job.id)
+                if stats['failed'] > stats['unreachable'] else None
+            )
+        )
+        logger.info(f"Рассылка {job.id} завершена со статусом {status}")
+
+
+# Воркер рассылок этого процесса
+broadcast_worker = BroadcastWorker()
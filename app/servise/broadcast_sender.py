@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterable, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости отправки по алгоритму token bucket.
+
+    Токены пополняются со скоростью rate в секунду, но не больше capacity.
+    При ответе 429 от Telegram бакет ставится на паузу целиком,
+    чтобы все воркеры одновременно переждали retry_after.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов на указанное время"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        """Ожидает, пока не появится свободный токен, и забирает его"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                # Время паузы не идет в зачет пополнения бакета
+                elapsed = now - max(self._updated, self._paused_until)
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastSender:
+    """
+    Движок рассылки: пул воркеров забирает получателей из очереди
+    и отправляет сообщения через общий token bucket.
+
+    Получатели передаются пачками пар (users.id, Telegram ID) или троек
+    с данными для персонализации, которые передаются в send. Движок ведет
+    чекпоинт — наибольший users.id, до которого все получатели уже обработаны,
+    и периодически отдает его в on_checkpoint вместе со счетчиками получателей
+    до чекпоинта, чтобы рассылку можно было продолжить без двойного учета.
+
+    Args:
+        send (Callable[..., Awaitable]): Корутина отправки сообщения одному получателю:
+            send(chat_id) или send(chat_id, context) для троек
+        rate (float): Глобальный лимит сообщений в секунду
+        workers (int): Количество параллельных воркеров
+        max_retries (int): Сколько раз повторять отправку после 429
+        on_checkpoint (Callable[[int, Tuple[int, int, int]], Awaitable]): Сохранение чекпоинта
+            и счетчиков (success, failed, unreachable) получателей до него
+        checkpoint_every (int): Как часто (в отправках) сохранять чекпоинт
+        start_pk (int): Начальный чекпоинт при продолжении рассылки
+        on_result (Callable[[int, int, str, Optional[str]], None]): Результат доставки
+            каждому получателю: (users.id, Telegram ID, sent / failed / unreachable, ошибка)
+    """
+
+    def __init__(
+        self,
+        send: Callable[..., Awaitable],
+        rate: float = Config.BROADCAST_RATE,
+        workers: int = Config.BROADCAST_WORKERS,
+        max_retries: int = 5,
+        on_checkpoint: Optional[Callable[[int, Tuple[int, int, int]], Awaitable]] = None,
+        checkpoint_every: int = Config.BROADCAST_CHECKPOINT_EVERY,
+        start_pk: int = 0,
+        on_result: Optional[Callable[[int, int, str, Optional[str]], None]] = None,
+    ):
+        self._send = send
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.max_retries = max_retries
+        self._on_checkpoint = on_checkpoint
+        self._on_result = on_result
+        self._checkpoint_every = checkpoint_every
+        self._checkpoint_lock = asyncio.Lock()
+        # Пачки в работе: [последний users.id пачки, сколько получателей осталось,
+        # успешно, ошибок, недоступных в пачке]
+        self._pending_batches: deque = deque()
+        self.checkpoint = start_pk
+        # Счетчики только по получателям до чекпоинта: получатели после него
+        # будут отправлены заново при продолжении и не должны учитываться дважды
+        self.checkpoint_counts: Tuple[int, int, int] = (0, 0, 0)
+        self._cancelled = False
+
+        self.success = 0
+        self.failed = 0
+        self.rate_limited = 0  # Количество ответов 429 от Telegram
+        self.unreachable = 0  # Заблокировали бота или удалили аккаунт
+        # Недоступные пользователи, еще не записанные в БД
+        self._unreachable_ids: List[int] = []
+        self.start_time: Optional[datetime] = None
+        self.end_time: Optional[datetime] = None
+
+    @property
+    def processed(self) -> int:
+        return self.success + self.failed
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def elapsed(self) -> float:
+        """Время работы рассылки в секундах"""
+        if not self.start_time:
+            return 0.0
+        end = self.end_time or datetime.now()
+        return (end - self.start_time).total_seconds()
+
+    @property
+    def throughput(self) -> float:
+        """Средняя скорость отправки, сообщений в секунду"""
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def drain_unreachable(self) -> List[int]:
+        """Забирает накопленные ID недоступных пользователей для записи в БД"""
+        user_ids, self._unreachable_ids = self._unreachable_ids, []
+        return user_ids
+
+    def cancel(self):
+        """Останавливает рассылку: новые сообщения больше не отправляются"""
+        self._cancelled = True
+
+    async def run(self, recipients: AsyncIterable[Iterable[tuple]]):
+        """
+        Отправляет сообщение всем получателям.
+
+        Args:
+            recipients (AsyncIterable[Iterable[tuple]]): Пачки пар (users.id, Telegram ID)
+                или троек (users.id, Telegram ID, данные для персонализации)
+        """
+        self.start_time = datetime.now()
+        # Ограниченная очередь не дает продюсеру убежать далеко вперед воркеров
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        tasks = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+
+        try:
+            async for batch in recipients:
+                if self._cancelled:
+                    break
+                batch = list(batch)
+                if not batch:
+                    continue
+                entry = [batch[-1][0], len(batch), 0, 0, 0]
+                self._pending_batches.append(entry)
+                for recipient in batch:
+                    if self._cancelled:
+                        break
+                    await queue.put((entry, recipient))
+        finally:
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+            self.end_time = datetime.now()
+            await self.flush_checkpoint()
+
+        logger.info(
+            f"Рассылка завершена: успешно {self.success}, ошибок {self.failed}, "
+            f"429: {self.rate_limited}, скорость {self.throughput:.1f} сообщ/с"
+        )
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if self._cancelled:
+                continue
+            entry, recipient = item
+            pk, chat_id = recipient[0], recipient[1]
+            status, error = await self._deliver(chat_id, recipient[2] if len(recipient) > 2 else None)
+            if self._on_result:
+                self._on_result(pk, chat_id, status, error)
+            self._complete(entry, status)
+
+            if self._on_checkpoint and self.processed % self._checkpoint_every == 0:
+                await self.flush_checkpoint()
+
+    def _complete(self, entry: list, status: str):
+        """Отмечает получателя обработанным и сдвигает чекпоинт по завершенным пачкам"""
+        entry[1] -= 1
+        if status == 'sent':
+            entry[2] += 1
+        else:
+            entry[3] += 1
+            if status == 'unreachable':
+                entry[4] += 1
+        while self._pending_batches and self._pending_batches[0][1] == 0:
+            last_pk, _, success, failed, unreachable = self._pending_batches.popleft()
+            self.checkpoint = last_pk
+            done_success, done_failed, done_unreachable = self.checkpoint_counts
+            self.checkpoint_counts = (
+                done_success + success, done_failed + failed, done_unreachable + unreachable
+            )
+
+    async def flush_checkpoint(self):
+        """Сохраняет текущий чекпоинт и счетчики до него через on_checkpoint"""
+        if not self._on_checkpoint:
+            return
+        # Блокировка не дает старому чекпоинту перезаписать более новый
+        async with self._checkpoint_lock:
+            try:
+                # Чекпоинт и счетчики берем вместе, до первого await
+                await self._on_checkpoint(self.checkpoint, self.checkpoint_counts)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении чекпоинта рассылки: {e}")
+
+    async def _deliver(self, chat_id: int, context=None) -> Tuple[str, Optional[str]]:
+        """
+        Отправляет сообщение одному получателю с учетом 429.
+
+        Returns:
+            Tuple[str, Optional[str]]: Статус (sent / failed / unreachable) и текст ошибки
+        """
+        for _ in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                if context is None:
+                    await self._send(chat_id)
+                else:
+                    await self._send(chat_id, context)
+            except TelegramRetryAfter as e:
+                # Это не ошибка получателя: ждем всем бакетом и повторяем
+                self.rate_limited += 1
+                logger.warning(f"Flood control при рассылке, пауза {e.retry_after} сек")
+                self.bucket.pause(e.retry_after)
+                continue
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                if isinstance(e, TelegramForbiddenError) or "user is deactivated" in str(e):
+                    # Получатель больше недоступен, исключаем его из будущих рассылок
+                    self.unreachable += 1
+                    self._unreachable_ids.append(chat_id)
+                    self.failed += 1
+                    return 'unreachable', e.message
+                logger.error(f"Failed to send broadcast to user {chat_id}: {e}")
+                self.failed += 1
+                return 'failed', e.message
+            except Exception as e:
+                logger.error(f"Failed to send broadcast to user {chat_id}: {e}")
+                self.failed += 1
+                return 'failed', str(e)
+            self.success += 1
+            return 'sent', None
+
+        logger.error(f"Failed to send broadcast to user {chat_id}: превышено число повторов после 429")
+        self.failed += 1
+        return 'failed', 'Too Many Requests: превышено число повторов'
@@ -0,0 +1,65 @@
+import html
+import re
+from typing import Callable, List, Optional
+
+# Подстановки, доступные в тексте рассылки: {поле} -> описание для админа
+TEMPLATE_FIELDS = {
+    'balans': 'баланс пользователя',
+    'invites': 'количество приглашенных',
+    'username': 'юзернейм без @',
+    'user_id': 'Telegram ID',
+}
+
+# Все прочие фигурные скобки в тексте остаются как есть
+_PLACEHOLDER = re.compile(r"\{(" + "|".join(TEMPLATE_FIELDS) + r")\}")
+
+
+def find_template_fields(text: Optional[str]) -> List[str]:
+    """
+    Находит подстановки в тексте рассылки.
+
+    Args:
+        text (Optional[str]): Текст или подпись сообщения
+
+    Returns:
+        List[str]: Имена полей в порядке первого появления
+    """
+    if not text:
+        return []
+    return list(dict.fromkeys(_PLACEHOLDER.findall(text)))
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        # 12.0 -> 12, 12.50 -> 12.5
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def compile_template(text: str) -> Callable[[dict], str]:
+    """
+    Один раз разбирает шаблон на куски текста и подстановки.
+    Для каждого получателя остается только склеить куски со значениями.
+
+    Args:
+        text (str): HTML-текст с подстановками вида {balans}
+
+    Returns:
+        Callable[[dict], str]: Функция отрисовки по значениям полей получателя
+    """
+    # Нечетные элементы — имена полей, четные — текст между ними
+    parts = _PLACEHOLDER.split(text)
+    literals = parts[0::2]
+    fields = parts[1::2]
+
+    def render(values: dict) -> str:
+        chunks = [literals[0]]
+        for field, literal in zip(fields, literals[1:]):
+            # Значения экранируются: юзернейм не должен ломать HTML-разметку
+            chunks.append(html.escape(_format_value(values.get(field))))
+            chunks.append(literal)
+        return "".join(chunks)
+
+    return render
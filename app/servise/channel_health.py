@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import ChatMember
+
+import app.database.db_queries as qu
+from app.bot import bot
+from app.database.database import Chanel, OPChannel
+from config import Config
+from .broadcast_sender import TokenBucket
+from .task_catalog import task_catalog
+
+logger = logging.getLogger('bot')
+
+# Статусы бота в канале, при которых он может проверять подписчиков
+BOT_ADMIN_STATUSES = ("administrator", "creator")
+
+# Ошибки Bot API, которые говорят о проблеме с самим каналом, а не с пользователем
+CHANNEL_ERRORS = (
+    "chat not found",
+    "member list is inaccessible",
+    "bot is not a member",
+    "bot was kicked",
+    "not enough rights",
+    "channel_private",
+)
+
+
+class ChannelUnavailable(Exception):
+    """Канал временно исключен из проверок: его цепь разомкнута"""
+
+    def __init__(self, channel_id: int):
+        super().__init__(f"Канал {channel_id} недоступен")
+        self.channel_id = channel_id
+
+
+def is_channel_error(error: Exception) -> bool:
+    """Относится ли ошибка Bot API к каналу (удален, бот потерял права и т.п.)"""
+    if not isinstance(error, (TelegramBadRequest, TelegramForbiddenError)):
+        return False
+    message = error.message.lower()
+    return any(marker in message for marker in CHANNEL_ERRORS)
+
+
+@dataclass
+class _Circuit:
+    failures: int = 0
+    open_until: float = 0.0  # 0 — цепь замкнута
+    cooldown: float = 0.0
+    probing: bool = False  # Идет пробный запрос в полуоткрытом состоянии
+    last_error: str = ""
+
+
+class ChannelCircuitBreaker:
+    """
+    Предохранитель на каждый канал для запросов getChatMember.
+
+    После threshold подряд ошибок канала цепь размыкается: проверки этого канала
+    сразу получают ChannelUnavailable, не дожидаясь Telegram. По истечении паузы
+    один запрос пропускается как пробный: успех замыкает цепь, ошибка размыкает
+    ее снова с удвоенной паузой (не больше max_cooldown). Админы получают одно
+    уведомление при размыкании и одно при восстановлении.
+
+    Args:
+        threshold (int): Сколько ошибок подряд размыкают цепь
+        cooldown (float): Начальная пауза перед пробным запросом, сек
+        max_cooldown (float): Максимальная пауза, сек
+        on_open (Callable): Уведомление о размыкании цепи (channel_id, текст ошибки)
+        on_close (Callable): Уведомление о восстановлении канала (channel_id)
+    """
+
+    def __init__(
+        self,
+        threshold: int = Config.CHANNEL_BREAKER_THRESHOLD,
+        cooldown: float = Config.CHANNEL_BREAKER_COOLDOWN,
+        max_cooldown: float = Config.CHANNEL_BREAKER_MAX_COOLDOWN,
+        on_open: Optional[Callable[[int, str], Awaitable]] = None,
+        on_close: Optional[Callable[[int], Awaitable]] = None,
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._on_open = on_open
+        self._on_close = on_close
+        self._circuits: Dict[int, _Circuit] = {}
+
+    def is_open(self, channel_id: int) -> bool:
+        """Разомкнута ли цепь канала (включая ожидание пробного запроса)"""
+        circuit = self._circuits.get(channel_id)
+        return bool(circuit and circuit.open_until)
+
+    async def call(self, channel_id: int, request: Callable[[], Awaitable]):
+        """
+        Выполняет запрос к каналу через предохранитель.
+
+        Raises:
+            ChannelUnavailable: Цепь разомкнута или пробный запрос уже выполняется
+        """
+        circuit = self._circuits.get(channel_id)
+        probe = False
+        if circuit and circuit.open_until:
+            if time.monotonic() < circuit.open_until or circuit.probing:
+                raise ChannelUnavailable(channel_id)
+            # Полуоткрытое состояние: пропускаем один пробный запрос
+            circuit.probing = True
+            probe = True
+
+        try:
+            result = await request()
+        except Exception as e:
+            if is_channel_error(e):
+                self._record_failure(channel_id, str(e))
+            raise
+        finally:
+            if probe:
+                # Сбой сети, 429 или отмена по таймауту (CancelledError — не Exception)
+                # ничего не говорят о канале: следующий вызов снова сможет проверить его
+                circuit.probing = False
+
+        if circuit:
+            self._record_success(channel_id)
+        return result
+
+    def _record_failure(self, channel_id: int, error: str):
+        circuit = self._circuits.setdefault(channel_id, _Circuit())
+        circuit.failures += 1
+        circuit.last_error = error
+        was_open = bool(circuit.open_until)
+        circuit.probing = False
+
+        if was_open:
+            circuit.cooldown = min(circuit.cooldown * 2, self.max_cooldown)
+            circuit.open_until = time.monotonic() + circuit.cooldown
+        elif circuit.failures >= self.threshold:
+            circuit.cooldown = self.cooldown
+            circuit.open_until = time.monotonic() + circuit.cooldown
+            logger.error(f"Канал {channel_id} исключен из проверок: {error}")
+            if self._on_open:
+                asyncio.create_task(self._notify(self._on_open(channel_id, error)))
+
+    def _record_success(self, channel_id: int):
+        circuit = self._circuits.pop(channel_id, None)
+        if circuit and circuit.open_until:
+            logger.info(f"Канал {channel_id} снова доступен")
+            if self._on_close:
+                asyncio.create_task(self._notify(self._on_close(channel_id)))
+
+    @staticmethod
+    async def _notify(coro: Awaitable):
+        try:
+            await coro
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление о канале: {e}")
+
+
+async def alert_admins(text: str):
+    """Отправляет уведомление всем админам"""
+    for admin_id in Config.ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text, parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+
+
+async def _on_channel_open(channel_id: int, error: str):
+    await alert_admins(
+        f"⚠️ <b>Канал недоступен</b>\n\n"
+        f"🆔 <code>{channel_id}</code>\n"
+        f"❌ {error}\n\n"
+        f"Проверки подписки на этот канал временно отключены. "
+        f"Проверьте, что канал существует и бот в нем администратор."
+    )
+
+
+async def _on_channel_close(channel_id: int):
+    await alert_admins(f"✅ Канал <code>{channel_id}</code> снова доступен, проверки возобновлены")
+
+
+# Общий предохранитель для всех проверок подписки
+channel_breaker = ChannelCircuitBreaker(on_open=_on_channel_open, on_close=_on_channel_close)
+
+# Время пользовательских getChatMember за последнюю секунду: по нему фоновые задачи уступают лимит
+_interactive_calls: deque = deque(maxlen=1000)
+
+
+def interactive_call_rate() -> int:
+    """Сколько пользовательских проверок подписки было за последнюю секунду"""
+    threshold = time.monotonic() - 1
+    while _interactive_calls and _interactive_calls[0] < threshold:
+        _interactive_calls.popleft()
+    return len(_interactive_calls)
+
+
+async def get_chat_member(channel_id: int, user_id: int, interactive: bool = True) -> ChatMember:
+    """
+    getChatMember через предохранитель канала.
+
+    Args:
+        channel_id (int): ID канала
+        user_id (int): Telegram ID пользователя
+        interactive (bool): Запрос по действию пользователя (False — фоновая задача)
+
+    Raises:
+        ChannelUnavailable: Канал временно исключен из проверок
+    """
+    if interactive:
+        _interactive_calls.append(time.monotonic())
+    return await channel_breaker.call(
+        channel_id, lambda: bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+    )
+
+
+class ChannelHealthProber:
+    """
+    Фоновая проверка ОП каналов и каналов заданий.
+
+    Раз в CHANNEL_PROBE_INTERVAL обходит все активные каналы и запрашивает
+    getChatMember для самого бота не быстрее CHANNEL_PROBE_RATE запросов в секунду.
+    Результат сохраняется в health_status канала: каналы с not_found скрываются
+    из ОП и заданий, а каналы, где бот потерял права администратора, отключаются.
+    """
+
+    def __init__(self, interval: float = Config.CHANNEL_PROBE_INTERVAL, rate: float = Config.CHANNEL_PROBE_RATE):
+        self.interval = interval
+        self.bucket = TokenBucket(rate)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info("Фоновая проверка каналов запущена")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой проверки каналов: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def probe_all(self):
+        """Проверяет все активные каналы один раз"""
+        op_channels, task_channels = await qu.get_channels_for_health_check()
+        for channel in op_channels:
+            await self._probe(OPChannel, channel.id, channel.channel_id, channel.name, channel.health_status)
+        for channel in task_channels:
+            await self._probe(Chanel, channel.id, channel.chanel_id, channel.chanel_name, channel.health_status)
+
+    async def _probe(self, model, channel_pk: int, channel_id: int, name: str, previous: Optional[str]):
+        await self.bucket.acquire()
+        try:
+            member = await bot.get_chat_member(chat_id=channel_id, user_id=bot.id)
+        except Exception as e:
+            if not is_channel_error(e):
+                # Сеть или 429: о канале ничего не известно, проверим в следующий раз
+                logger.warning(f"Не удалось проверить канал {channel_id}: {e}")
+                return
+            status = 'not_found' if "chat not found" in e.message.lower() else 'no_rights'
+            error = e.message
+        else:
+            status = 'ok' if member.status in BOT_ADMIN_STATUSES else 'no_rights'
+            error = None if status == 'ok' else f"Статус бота в канале: {member.status}"
+
+        deactivate = status == 'no_rights'
+        await qu.save_channel_health(model, channel_pk, status, error, deactivate=deactivate)
+        if model is Chanel and (deactivate or status != previous):
+            # Отключенное или удаленное задание не должно выдаваться до планового обновления каталога
+            task_catalog.invalidate()
+
+        if deactivate:
+            kind = "ОП канал" if model is OPChannel else "Канал задания"
+            await alert_admins(
+                f"🚫 <b>{kind} отключен</b>\n\n"
+                f"📢 {name or channel_id} (<code>{channel_id}</code>)\n"
+                f"❌ {error}\n\n"
+                f"Бот больше не администратор канала. Верните права и включите канал снова."
+            )
+        elif status != previous and previous is not None:
+            logger.info(f"Канал {channel_id}: состояние {previous} -> {status}")
+
+
+# Фоновая проверка каналов этого процесса
+channel_prober = ChannelHealthProber()
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+import app.database.db_queries as qu
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryLogWriter:
+    """
+    Буферизованный журнал доставки рассылки.
+
+    Результаты отправки копятся в памяти и пишутся в broadcast_deliveries
+    многострочным INSERT, когда набралось batch_size строк или прошло
+    flush_interval секунд. Так рассылка на миллион получателей дает
+    тысячи коммитов, а не миллион.
+
+    Args:
+        job_id (int): ID задачи рассылки
+        batch_size (int): Сколько строк писать одним INSERT
+        flush_interval (float): Максимальная задержка записи в секундах
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        batch_size: int = Config.BROADCAST_DELIVERY_BATCH,
+        flush_interval: float = Config.BROADCAST_DELIVERY_FLUSH_INTERVAL,
+    ):
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[dict] = []
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, user_pk: int, user_id: int, status: str, error: Optional[str] = None):
+        """Добавляет результат доставки одному получателю в буфер"""
+        self._buffer.append({
+            'job_id': self.job_id,
+            'user_pk': user_pk,
+            'user_id': user_id,
+            'status': status,
+            'error': error[:255] if error else None,
+            'created_at': datetime.now(),
+        })
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    def start(self):
+        """Запускает фоновую запись буфера"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Останавливает фоновую запись и сбрасывает остаток буфера"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные строки пачками по batch_size"""
+        async with self._flush_lock:
+            while self._buffer:
+                rows = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                try:
+                    await qu.add_broadcast_deliveries(rows)
+                except Exception as e:
+                    # Журнал вспомогательный: его сбой не должен останавливать рассылку
+                    logger.error(f"Ошибка при записи журнала доставки рассылки {self.job_id}: {e}")
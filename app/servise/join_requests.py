@@ -0,0 +1,92 @@
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class _ChannelJoinRequests:
+    """
+    Заявки одного канала: словарь для поиска и куча сроков для истечения.
+
+    Повторная заявка не удаляет старую запись из кучи, а просто переносит срок
+    в словаре; устаревшая запись кучи пропускается при истечении.
+    """
+
+    __slots__ = ('deadlines', 'heap')
+
+    def __init__(self):
+        self.deadlines: Dict[int, float] = {}  # {user_id: срок действия заявки}
+        self.heap: List[Tuple[float, int]] = []  # (срок, user_id), ближайший срок сверху
+
+    def add(self, user_id: int, deadline: float):
+        self.deadlines[user_id] = deadline
+        heapq.heappush(self.heap, (deadline, user_id))
+
+    def expire(self, now: float) -> int:
+        """Удаляет истекшие заявки с вершины кучи. Returns: сколько удалено"""
+        removed = 0
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            deadline, user_id = heapq.heappop(heap)
+            if self.deadlines.get(user_id) == deadline:
+                del self.deadlines[user_id]
+                removed += 1
+        return removed
+
+
+class JoinRequestStore:
+    """
+    Хранилище заявок на вступление с истечением по сроку.
+
+    Заявки разложены по каналам. Добавление — O(log n), проверка — O(1),
+    истечение снимает с кучи только истекшие записи и никогда не обходит
+    все заявки целиком. Все операции синхронные и не содержат await,
+    поэтому в asyncio им не нужна блокировка.
+
+    Args:
+        ttl (float): Сколько секунд заявка считается действующей
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._channels: Dict[int, _ChannelJoinRequests] = {}
+
+    def add(self, channel_id: int, user_id: int, created_at: Optional[float] = None):
+        """Сохраняет заявку пользователя в канал"""
+        now = time.time()
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = _ChannelJoinRequests()
+        else:
+            # Попутно снимаем истекшие заявки этого канала, чтобы куча не росла
+            channel.expire(now)
+        channel.add(user_id, (created_at or now) + self.ttl)
+
+    def contains(self, channel_id: int, user_id: int) -> bool:
+        """Есть ли у пользователя действующая заявка в канал"""
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return False
+        deadline = channel.deadlines.get(user_id)
+        return deadline is not None and deadline > time.time()
+
+    def expire(self) -> int:
+        """
+        Удаляет истекшие заявки во всех каналах и пустые каналы.
+
+        Returns:
+            int: Количество удаленных заявок
+        """
+        now = time.time()
+        removed = 0
+        for channel_id in list(self._channels):
+            channel = self._channels[channel_id]
+            removed += channel.expire(now)
+            if not channel.deadlines:
+                del self._channels[channel_id]
+        return removed
+
+    def clear(self):
+        self._channels.clear()
+
+    def __len__(self) -> int:
+        return sum(len(channel.deadlines) for channel in self._channels.values())
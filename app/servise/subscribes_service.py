@@ -1,4 +1,3 @@
-from ..bot import  bot
 from aiogram import types, F, Router
 from aiogram.filters import CommandStart
 from aiogram.types import (
@@ -11,31 +10,55 @@ from aiogram.types import (
 import time
 import asyncio
 import logging
-import signal
 from ..database import db_queries as qu
-from collections import defaultdict
+from .join_requests import JoinRequestStore
+from .channel_health import ChannelUnavailable, get_chat_member
+from cachetools import LRUCache, TTLCache
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from config import Config
 
 logger = logging.getLogger('bot')
 
 r = Router()
 
+# Статусы участника, при которых пользователь считается подписанным
+MEMBER_STATUSES = ("member", "administrator", "creator", "restricted")
+
 # Сервис который будет проверять подписки пользователей на нужные нам каналы
 class UserSubscribeService:
     def __init__(self):
-        # Используем defaultdict для эффективного хранения заявок
-        # Структура: {channel_id: {user_id: timestamp}}
-        self._join_requests = defaultdict(dict)
         self.CLEANUP_INTERVAL = 60  # Проверка каждые 60 секунд
         self.REQUEST_TIMEOUT = 300  # 5 минут в секундах
+        # Заявки на вступление по каналам с истечением по сроку, без общей блокировки
+        self._join_requests = JoinRequestStore(self.REQUEST_TIMEOUT)
+        # Заявки, еще не записанные в БД: {(channel_id, user_id): строка для upsert}
+        self._pending_join_requests: Dict[tuple, dict] = {}
+        self._join_requests_full = asyncio.Event()
+        self._flush_task = None
         self._cleanup_task = None
-        self._lock = asyncio.Lock()  # Для безопасного доступа к данным
         self._is_running = False
+        self.CHECK_CONCURRENCY = Config.SUBSCRIPTION_CHECK_CONCURRENCY
+        self.CHECK_TIMEOUT = Config.SUBSCRIPTION_CHECK_TIMEOUT
+        # Кэш результатов getChatMember по (user_id, channel_id). Подписку помним долго,
+        # ее отсутствие — недолго: пользователь может подписаться в любой момент,
+        # но повторные нажатия «Я подписался» подряд не должны ходить в Telegram
+        self._subscribed_cache = TTLCache(
+            maxsize=Config.SUBSCRIPTION_CACHE_SIZE, ttl=Config.SUBSCRIPTION_POSITIVE_TTL
+        )
+        self._not_subscribed_cache = TTLCache(
+            maxsize=Config.SUBSCRIPTION_CACHE_SIZE, ttl=Config.SUBSCRIPTION_NEGATIVE_TTL
+        )
+        # Индекс участников из апдейтов chat_member: {(user_id, channel_id): состоит ли в канале}.
+        # Telegram присылает их по каналам, где бот админ, поэтому запись здесь точнее кэша
+        self._members = LRUCache(maxsize=Config.MEMBERSHIP_INDEX_SIZE)
 
     async def start(self):
         """Запускает фоновую задачу очистки заявок"""
         if self._cleanup_task is None and not self._is_running:
             self._is_running = True
             self._cleanup_task = asyncio.create_task(self._cleanup_old_requests())
+            self._flush_task = asyncio.create_task(self._flush_join_requests_loop())
             logger.info("Задача очистки заявок запущена")
 
     async def stop(self):
@@ -49,31 +72,28 @@ class UserSubscribeService:
                 except asyncio.CancelledError:
                     pass
             self._cleanup_task = None
-            # Очищаем все заявки при остановке
-            async with self._lock:
-                self._join_requests.clear()
+            if self._flush_task and not self._flush_task.done():
+                self._flush_task.cancel()
+                try:
+                    await self._flush_task
+                except asyncio.CancelledError:
+                    pass
+            self._flush_task = None
+            # Дописываем заявки в БД: после перезапуска они подхватятся оттуда
+            await self.flush_join_requests()
+            self._join_requests.clear()
             logger.info("Сервис подписок остановлен")
 
     async def _cleanup_old_requests(self):
-        """Периодически очищает устаревшие заявки"""
+        """Периодически снимает истекшие заявки (только их, без обхода всех заявок)"""
         while self._is_running:
             try:
-                async with self._lock:
-                    current_time = time.time()
-                    # Очищаем устаревшие заявки для каждого канала
-                    for channel_id in list(self._join_requests.keys()):
-                        # Очищаем устаревшие заявки для канала
-                        self._join_requests[channel_id] = {
-                            user_id: timestamp
-                            for user_id, timestamp in self._join_requests[channel_id].items()
-                            if current_time - timestamp < self.REQUEST_TIMEOUT
-                        }
-                        # Удаляем пустой канал
-                        if not self._join_requests[channel_id]:
-                            del self._join_requests[channel_id]
-                    
-                    total_requests = sum(len(requests) for requests in self._join_requests.values())
-                    logger.info(f"Очистка заявок выполнена. Осталось заявок: {total_requests}")
+                removed = self._join_requests.expire()
+                removed_db = await qu.delete_expired_join_requests()
+                logger.info(
+                    f"Очистка заявок выполнена. Удалено: {removed} в памяти, {removed_db} в БД, "
+                    f"осталось в памяти: {len(self._join_requests)}"
+                )
             except asyncio.CancelledError:
                 logger.info("Задача очистки заявок остановлена")
                 break
@@ -85,13 +105,77 @@ class UserSubscribeService:
             except asyncio.CancelledError:
                 break
 
-    async def is_user_subscribed(self, user_id: int, channel_id: int, is_join_request: bool = False) -> bool:
+    def _add_join_request(self, channel_id: int, user_id: int):
+        """Сохраняет заявку в памяти и ставит ее в очередь на запись в БД"""
+        now = time.time()
+        self._join_requests.add(channel_id, user_id, now)
+        self._pending_join_requests[(channel_id, user_id)] = {
+            'channel_id': channel_id,
+            'user_id': user_id,
+            'created_at': datetime.fromtimestamp(now),
+            'expires_at': datetime.fromtimestamp(now + self.REQUEST_TIMEOUT),
+        }
+        if len(self._pending_join_requests) >= Config.JOIN_REQUEST_BATCH:
+            self._join_requests_full.set()
+
+    async def flush_join_requests(self):
+        """Записывает накопленные заявки в БД пачками"""
+        while self._pending_join_requests:
+            rows: List[dict] = list(self._pending_join_requests.values())[:Config.JOIN_REQUEST_BATCH]
+            for row in rows:
+                self._pending_join_requests.pop((row['channel_id'], row['user_id']), None)
+            try:
+                await qu.upsert_join_requests(rows)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении заявок на вступление: {e}")
+                # Возвращаем пачку в очередь, не затирая более свежие заявки, и ждем следующего раза
+                for row in rows:
+                    self._pending_join_requests.setdefault((row['channel_id'], row['user_id']), row)
+                return
+
+    async def _flush_join_requests_loop(self):
+        """Пишет заявки в БД, когда набралась пачка или прошел интервал"""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._join_requests_full.wait(), timeout=Config.JOIN_REQUEST_FLUSH_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._join_requests_full.clear()
+            await self.flush_join_requests()
+
+    async def _has_join_request(self, channel_id: int, user_id: int) -> bool:
+        """
+        Ищет заявку в памяти, а при промахе — в БД: ее могли принять
+        до перезапуска или другим процессом бота.
+        """
+        if self._join_requests.contains(channel_id, user_id):
+            return True
+        expires_at = await qu.get_join_request_expiry(channel_id, user_id)
+        if expires_at is None:
+            return False
+        # Кладем найденную заявку в память с тем же сроком действия
+        self._join_requests.add(channel_id, user_id, expires_at.timestamp() - self.REQUEST_TIMEOUT)
+        return True
+
+    def known_membership(self, user_id: int, channel_id: int) -> Optional[bool]:
+        """
+        Состояние подписки из индекса chat_member без запроса к Telegram.
+
+        :return: True/False, если состояние известно из апдейтов, иначе None.
+        """
+        return self._members.get((user_id, channel_id))
+
+    async def is_user_subscribed(self, user_id: int, channel_id: int, is_join_request: bool = False,
+                                 skip_unavailable: bool = False) -> bool:
         """
         Асинхронная проверка подписки пользователя на канал.
 
         :param user_id: ID пользователя Telegram.
         :param channel_id: ID или username канала.
         :param is_join_request: True если канал настроен на заявки, False если на подписки.
+        :param skip_unavailable: Что вернуть без запроса к Telegram, если канал отключен предохранителем.
         :return: True, если пользователь подписан или подал заявку, иначе False.
         """
         try:
@@ -101,59 +185,115 @@ class UserSubscribeService:
 
             # Для каналов на заявки проверяем только наличие заявки в кэше
             if is_join_request:
-                async with self._lock:
-                    if channel_id in self._join_requests and user_id in self._join_requests[channel_id]:
-                        timestamp = self._join_requests[channel_id][user_id]
-                        if time.time() - timestamp < self.REQUEST_TIMEOUT:
-                            return True
-                        else:
-                            # Удаляем устаревшую заявку
-                            del self._join_requests[channel_id][user_id]
-                            # Удаляем пустой канал
-                            if not self._join_requests[channel_id]:
-                                del self._join_requests[channel_id]
+                return await self._has_join_request(channel_id, user_id)
+
+            # Для обычных каналов сначала смотрим индекс участников, затем кэш
+            key = (user_id, channel_id)
+            is_member = self._members.get(key)
+            if is_member is not None:
+                return is_member
+            if key in self._subscribed_cache:
+                return True
+            if key in self._not_subscribed_cache:
                 return False
 
-            # Для обычных каналов проверяем подписку
             try:
-                member: ChatMember = await bot.get_chat_member(
-                    chat_id=channel_id, user_id=user_id
-                )
-                return member.status in ["member", "administrator", "creator", "restricted"]
+                member: ChatMember = await get_chat_member(channel_id, user_id)
+            except ChannelUnavailable:
+                return skip_unavailable
             except Exception as e:
+                # Ошибки не кэшируем, чтобы следующая проверка спросила Telegram заново
                 logger.error(f"Ошибка проверки подписки на канал {channel_id}: {e}")
                 return False
 
+            is_subscribed = member.status in MEMBER_STATUSES
+            if is_subscribed:
+                self._subscribed_cache[key] = True
+                self._not_subscribed_cache.pop(key, None)
+            else:
+                self._not_subscribed_cache[key] = True
+            return is_subscribed
+
         except Exception as e:
             logger.error(f"Критическая ошибка в is_user_subscribed для канала {channel_id}: {e}")
             return False
 
-    @r.chat_join_request()
-    async def on_chat_member_update(self, update: ChatJoinRequest):
-        """Обработчик новых заявок на вступление"""
+    async def check_subscriptions(self, user_id: int, channel_ids: Iterable[int]) -> Dict[int, bool]:
+        """
+        Параллельно проверяет подписку пользователя на несколько каналов.
+
+        Проверки идут одновременно (не больше SUBSCRIPTION_CHECK_CONCURRENCY) и укладываются
+        в общий дедлайн SUBSCRIPTION_CHECK_TIMEOUT. Канал, не ответивший вовремя,
+        считается неподписанным — так же, как при ошибке getChatMember.
+        Канал, отключенный предохранителем (удален, бот потерял права), пропускается:
+        подписаться на него пользователь все равно не сможет.
+
+        :param user_id: ID пользователя Telegram.
+        :param channel_ids: ID каналов на подписку.
+        :return: Словарь {channel_id: подписан ли пользователь}.
+        """
+        # Ограничивает число одновременных getChatMember в рамках одной проверки
+        semaphore = asyncio.Semaphore(self.CHECK_CONCURRENCY)
+
+        async def check(channel_id: int) -> bool:
+            async with semaphore:
+                return await self.is_user_subscribed(user_id, channel_id, skip_unavailable=True)
+
+        tasks = {
+            channel_id: asyncio.create_task(check(channel_id))
+            for channel_id in dict.fromkeys(channel_ids)
+        }
+        if not tasks:
+            return {}
+
+        done, pending = await asyncio.wait(tasks.values(), timeout=self.CHECK_TIMEOUT)
+        for task in pending:
+            task.cancel()
+
+        results = {}
+        for channel_id, task in tasks.items():
+            if task in done:
+                results[channel_id] = task.result()
+            else:
+                logger.error(f"Таймаут проверки подписки на канал {channel_id}")
+                results[channel_id] = False
+        return results
+
+    async def on_chat_member(self, update: ChatMemberUpdated):
+        """Обновляет индекс участников по апдейту chat_member из канала, где бот админ"""
+        try:
+            new_member = update.new_chat_member
+            is_member = new_member.status in MEMBER_STATUSES
+            if new_member.status == "restricted":
+                # Ограниченный пользователь может уже не состоять в канале
+                is_member = bool(getattr(new_member, "is_member", True))
+
+            key = (new_member.user.id, update.chat.id)
+            self._members[key] = is_member
+            # Кэш API для этой пары больше не нужен: индекс свежее
+            self._subscribed_cache.pop(key, None)
+            self._not_subscribed_cache.pop(key, None)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке chat_member: {e}")
+
+    async def on_chat_join_request(self, update: ChatJoinRequest):
+        """
+        Единая точка приема заявок на вступление: каждая заявка сохраняется один раз
+        в индексе по (канал, пользователь), которым пользуются и ОП, и задания.
+        """
         try:
             user_id = update.from_user.id
             chat_id = update.chat.id
 
-            async with self._lock:
-                self._join_requests[chat_id][user_id] = time.time()
-                logger.info(f"Добавлена заявка на вступление: канал {chat_id}, пользователь {user_id}")
+            self._add_join_request(chat_id, user_id)
+            logger.info(f"Добавлена заявка на вступление: канал {chat_id}, пользователь {user_id}")
         except Exception as e:
             logger.error(f"Ошибка при обработке заявки на вступление: {e}")
 
 # Создаем экземпляр сервиса
 subscribes_service = UserSubscribeService()
 
-# Регистрируем обработчики сигналов для корректного завершения
-def handle_exit(signum, frame):
-    """Обработчик сигналов завершения"""
-    logger.info(f"Получен сигнал {signum}, завершаем работу...")
-    loop = asyncio.get_event_loop()
-    if loop.is_running():
-        loop.create_task(subscribes_service.stop())
-        # Даем время на корректное завершение
-        loop.call_later(2, loop.stop)
-
-# Регистрируем обработчики сигналов
-signal.signal(signal.SIGTERM, handle_exit)
-signal.signal(signal.SIGINT, handle_exit)
+# Апдейты о заявках и участниках каналов принимает только этот роутер
+r.chat_join_request.register(subscribes_service.on_chat_join_request)
+# Апдейты о вступлении и выходе участников: по ним проверяем подписку без getChatMember
+r.chat_member.register(subscribes_service.on_chat_member, F.chat.type != "private")
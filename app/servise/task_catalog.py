@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set
+
+from cachetools import LRUCache
+
+import app.database.db_queries as qu
+from app.database.database import Chanel
+from config import Config
+
+logger = logging.getLogger('bot')
+
+
+class TaskCatalog:
+    """
+    Каталог заданий в памяти для выдачи следующего задания без запросов к БД.
+
+    Хранит активные каналы заданий с остатком лимита в порядке выдачи и для
+    каждого пользователя множество ID выполненных заданий. Множество читается
+    из БД один раз и дальше пополняется при выполнении заданий, поэтому выдача
+    следующего задания — проход по короткому списку без JOIN с user_tasks.
+
+    Каталог перечитывается после изменений каналов админом (invalidate) и не
+    реже чем раз в TASK_CATALOG_TTL, чтобы подхватить изменения фоновых задач.
+    """
+
+    def __init__(self, ttl: float = Config.TASK_CATALOG_TTL,
+                 completed_cache_size: int = Config.TASK_COMPLETED_CACHE_SIZE):
+        self.ttl = ttl
+        self._tasks: List[Chanel] = []  # Каналы в порядке выдачи
+        self._remaining: Dict[int, int] = {}  # {ID задания: остаток лимита}
+        self._loaded_at: Optional[float] = None  # None — каталог нужно перечитать
+        self._lock = asyncio.Lock()
+        # {user_id: множество ID выполненных заданий}, вытесняются давно не заходившие
+        self._completed = LRUCache(maxsize=completed_cache_size)
+
+    def invalidate(self):
+        """Помечает каталог устаревшим: следующий запрос перечитает его из БД"""
+        self._loaded_at = None
+
+    async def refresh(self):
+        """Перечитывает активные задания из БД"""
+        tasks = await qu.get_task_catalog()
+        self._tasks = list(tasks)
+        self._remaining = {task.id: task.limit for task in tasks}
+        self._loaded_at = time.monotonic()
+        logger.info(f"Каталог заданий обновлен: {len(self._tasks)} активных")
+
+    async def _ensure_fresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._lock:
+            # Пока ждали блокировку, каталог мог обновить другой запрос
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                await self.refresh()
+
+    async def _completed_ids(self, user_id: int) -> Set[int]:
+        completed = self._completed.get(user_id)
+        if completed is None:
+            completed = self._completed[user_id] = set(await qu.get_completed_task_ids(user_id))
+        return completed
+
+    async def get_next_task(self, user_id: int) -> Optional[Chanel]:
+        """
+        Следующее невыполненное задание пользователя.
+
+        Args:
+            user_id (int): ID пользователя
+
+        Returns:
+            Optional[Chanel]: Задание или None, если доступных заданий нет
+        """
+        await self._ensure_fresh()
+        completed = await self._completed_ids(user_id)
+        for task in self._tasks:
+            if task.id not in completed:
+                return task
+        return None
+
+    def remember_completed(self, user_id: int, task_id: int):
+        """
+        Добавляет задание в множество выполненных пользователем, не трогая лимит.
+        Нужно, когда задание засчитано в другом месте (другим процессом бота),
+        а закэшированное множество об этом не знает.
+        """
+        completed = self._completed.get(user_id)
+        if completed is not None:
+            completed.add(task_id)
+
+    def mark_completed(self, user_id: int, task_id: int):
+        """
+        Учитывает выполнение задания: пополняет множество пользователя и уменьшает
+        остаток лимита. Задание с исчерпанным лимитом перестает выдаваться сразу.
+        """
+        self.remember_completed(user_id, task_id)
+
+        remaining = self._remaining.get(task_id)
+        if remaining is None:
+            return
+        remaining -= 1
+        self._remaining[task_id] = remaining
+        if remaining <= 0:
+            self._tasks = [task for task in self._tasks if task.id != task_id]
+            del self._remaining[task_id]
+            logger.info(f"Задание {task_id} исчерпало лимит и убрано из каталога")
+
+
+# Каталог заданий этого процесса
+task_catalog = TaskCatalog()
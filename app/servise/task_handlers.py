@@ -1,37 +1,24 @@
 from aiogram import types, Router, Bot, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from app.database.db_queries import (
-    get_next_task, mark_task_completed, decrease_channel_limit, add_reward_to_user,
-    get_user_task, add_user_task, get_channel_by_task_id
-)
+from app.database.db_queries import complete_task, ensure_user_task, get_channel_by_task_id
 from aiogram.exceptions import TelegramBadRequest
-from cachetools import TTLCache
+from .subscribes_service import subscribes_service
+from .channel_health import ChannelUnavailable, get_chat_member
+from .task_catalog import task_catalog
 
 router = Router()
 
-# Кэш для хранения заявок на вступление с TTL 5 минут
-join_requests_cache = TTLCache(maxsize=1000, ttl=300)
-
-@router.chat_join_request()
-async def handle_join_request(event: types.ChatJoinRequest, bot: Bot):
-    """Сохраняем заявки на вступление в кэш."""
-    channel_id = event.chat.id
-    user_id = event.from_user.id
-    join_requests_cache.setdefault(channel_id, set()).add(user_id)
-
 @router.message(F.text == "📚 Задания")
 async def give_task(mes: types.Message):
     """Отправляем пользователю следующее задание."""
     user_id = mes.from_user.id
-    next_task = await get_next_task(user_id)
+    next_task = await task_catalog.get_next_task(user_id)
     if not next_task:
         await mes.answer("🎉 Все задания выполнены! Возвращайтесь позже.", show_alert=True)
         return
 
-    # Проверяем, есть ли задание в таблице user_tasks
-    user_task = await get_user_task(user_id, next_task.id)
-    if not user_task:
-        await add_user_task(user_id, next_task.id)
+    # Заводим запись о задании в user_tasks, если ее еще нет
+    await ensure_user_task(user_id, next_task.id)
 
      # Определяем текст задания в зависимости от типа канала
     action_text = "Подписаться" if next_task.sab else "Подать заявку"
@@ -63,13 +50,13 @@ async def check_subscription(callback_query: types.CallbackQuery, bot: Bot):
             await handle_join_request_check(bot, callback_query, chanel, user_id, task_id)
 
         # Проверяем следующее задание
-        next_task = await get_next_task(user_id)
+        next_task = await task_catalog.get_next_task(user_id)
         if next_task:
-            # Проверяем, есть ли запись о следующем задании в таблице user_tasks
-            user_task = await get_user_task(user_id, next_task.id)
-            if not user_task:
-                await add_user_task(user_id, next_task.id)
+            # Заводим запись о следующем задании в user_tasks, если ее еще нет
+            await ensure_user_task(user_id, next_task.id)
 
+            # То же задание уже показано в сообщении, меняем его только на новое
+            if next_task.id != task_id:
                 # Определяем текст задания в зависимости от типа канала
                 action_text = "Подписаться" if next_task.sab else "Подать заявку"
                 task_text = (
@@ -88,6 +75,12 @@ async def check_subscription(callback_query: types.CallbackQuery, bot: Bot):
                 parse_mode="HTML"
             )
 
+    except ChannelUnavailable:
+        # Канал уже известен как сломанный: отвечаем сразу, админы уведомлены
+        await callback_query.answer(
+            "⏳ Канал задания временно недоступен. Попробуйте позже.",
+            show_alert=True
+        )
     except TelegramBadRequest as e:
         error_message = "❌ Произошла ошибка, обратитесь в поддержку."
         if "chat not found" in str(e):
@@ -96,32 +89,49 @@ async def check_subscription(callback_query: types.CallbackQuery, bot: Bot):
             error_message += " Код ошибки: 2"
         await callback_query.answer(error_message, show_alert=True)
 
+async def finish_task(callback_query: types.CallbackQuery, user_id: int, task_id: int, success_text: str):
+    """Засчитываем выполнение задания и начисляем награду одной транзакцией."""
+    result = await complete_task(user_id, task_id)
+    if result.already_completed:
+        # Множество в каталоге могло устареть: иначе задание выдавалось бы снова
+        task_catalog.remember_completed(user_id, task_id)
+        await callback_query.answer("✅ Это задание уже выполнено, награда начислена ранее.", show_alert=True)
+        return
+    if not result.completed:
+        await callback_query.answer(
+            "❌ Задание не найдено. Откройте «📚 Задания», чтобы получить его заново.",
+            show_alert=True
+        )
+        return
+
+    task_catalog.mark_completed(user_id, task_id)
+    if not result.limit_decreased:
+        # Лимит канала исчерпан раньше, чем заметил каталог: перечитаем его
+        task_catalog.invalidate()
+    await callback_query.answer(success_text, show_alert=True)
+
+
 async def handle_subscription_check(bot: Bot, callback_query: types.CallbackQuery, chanel, user_id: int, task_id: int):
     """Обрабатываем проверку подписки на канал."""
-    member = await bot.get_chat_member(chat_id=chanel.chanel_id, user_id=user_id)
+    member = await get_chat_member(chanel.chanel_id, user_id)
     if member.status in ["member", "administrator", "creator"]:
-        await mark_task_completed(user_id, task_id)
-        await decrease_channel_limit(chanel.id)
-        await add_reward_to_user(user_id, chanel.reward)
-        await callback_query.answer("🎉 Вы подписаны на канал! Награда начислена. Следующее задание уже у вас", show_alert=True)
+        await finish_task(callback_query, user_id, task_id,
+                          "🎉 Вы подписаны на канал! Награда начислена. Следующее задание уже у вас")
     else:
         await callback_query.answer("❌ Вы не подписаны на канал. Пожалуйста, подпишитесь.", show_alert=True)
 
 
 async def handle_join_request_check(bot: Bot, callback_query: types.CallbackQuery, chanel, user_id: int, task_id: int):
     """Обрабатываем проверку заявки на вступление в канал."""
-    member = await bot.get_chat_member(chat_id=chanel.chanel_id, user_id=user_id)
+    member = await get_chat_member(chanel.chanel_id, user_id)
     if member.status in ["member"]:
         await callback_query.answer("❌ Вы подписаны на канал. Отпишитесь и подайте заявку заново.", show_alert=True)
     elif member.status in [ "administrator", "creator"]:
-        await mark_task_completed(user_id, task_id)
-        await decrease_channel_limit(chanel.id)
-        await add_reward_to_user(user_id, chanel.reward)
-        await callback_query.answer("🎉 Ваша заявка на вступление подтверждена! Награда начислена. Следующее задание уже у вас", show_alert=True)
-    elif chanel.chanel_id in join_requests_cache and user_id in join_requests_cache[chanel.chanel_id]:
-        await mark_task_completed(user_id, task_id)
-        await decrease_channel_limit(chanel.id)
-        await add_reward_to_user(user_id, chanel.reward)
-        await callback_query.answer("🎉 Ваша заявка на вступление подтверждена! Награда начислена. Следующее задание уже у вас", show_alert=True)
+        await finish_task(callback_query, user_id, task_id,
+                          "🎉 Ваша заявка на вступление подтверждена! Награда начислена. Следующее задание уже у вас")
+    elif await subscribes_service.is_user_subscribed(user_id, chanel.chanel_id, is_join_request=True):
+        # Заявки принимает сервис подписок, здесь только спрашиваем его индекс
+        await finish_task(callback_query, user_id, task_id,
+                          "🎉 Ваша заявка на вступление подтверждена! Награда начислена. Следующее задание уже у вас")
     else:
         await callback_query.answer("❌ Заявка не найдена. Пожалуйста, подайте заявку заново.", show_alert=True)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+import app.database.db_queries as qu
+from config import Config
+from .broadcast_sender import TokenBucket
+from .channel_health import ChannelUnavailable, get_chat_member, interactive_call_rate
+from .subscribes_service import MEMBER_STATUSES, subscribes_service
+
+logger = logging.getLogger('bot')
+
+
+class TaskRecheckSweeper:
+    """
+    Фоновая перепроверка выполненных заданий на подписку.
+
+    Раз в TASK_RECHECK_INTERVAL обходит задания, выполненные за последние
+    TASK_RECHECK_DAYS дней, пачками по user_tasks.id и проверяет, что пользователь
+    все еще подписан. Отписки записываются пачкой в user_tasks.unsubscribed_at,
+    по ним админ видит удержание подписчиков канала.
+
+    Проверки идут с низким приоритетом: не быстрее TASK_RECHECK_RATE запросов
+    в секунду, а пока пользовательских проверок больше TASK_RECHECK_YIELD_RATE
+    в секунду, перепроверка стоит на паузе. Состояние из индекса chat_member
+    используется без запроса к Telegram.
+    """
+
+    def __init__(self):
+        self.bucket = TokenBucket(Config.TASK_RECHECK_RATE)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info("Перепроверка выполненных заданий запущена")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка перепроверки заданий: {e}")
+            await asyncio.sleep(Config.TASK_RECHECK_INTERVAL)
+
+    async def sweep(self):
+        """Один проход по выполненным заданиям"""
+        since = datetime.now() - timedelta(days=Config.TASK_RECHECK_DAYS)
+        checked = unsubscribed = 0
+
+        async for rows in qu.iter_completed_subscription_tasks(since):
+            verified_ids, unsubscribed_ids = [], []
+            for row in rows:
+                is_member = await self._check(row.user_id, row.chanel_id)
+                if is_member is None:
+                    continue
+                (verified_ids if is_member else unsubscribed_ids).append(row.id)
+
+            await qu.mark_user_tasks_rechecked(verified_ids, unsubscribed_ids)
+            checked += len(verified_ids) + len(unsubscribed_ids)
+            unsubscribed += len(unsubscribed_ids)
+
+        logger.info(f"Перепроверка заданий завершена: проверено {checked}, отписались {unsubscribed}")
+
+    async def _check(self, user_id: int, channel_id: int) -> Optional[bool]:
+        """
+        Returns:
+            Optional[bool]: Подписан ли пользователь, None — проверить не удалось
+        """
+        known = subscribes_service.known_membership(user_id, channel_id)
+        if known is not None:
+            return known
+
+        # Уступаем лимит Bot API пользовательским проверкам
+        while interactive_call_rate() >= Config.TASK_RECHECK_YIELD_RATE:
+            await asyncio.sleep(1)
+        await self.bucket.acquire()
+
+        try:
+            member = await get_chat_member(channel_id, user_id, interactive=False)
+        except ChannelUnavailable:
+            return None
+        except Exception as e:
+            logger.warning(f"Не удалось перепроверить подписку {user_id} на канал {channel_id}: {e}")
+            return None
+
+        if member.status == "restricted":
+            return bool(getattr(member, "is_member", True))
+        return member.status in MEMBER_STATUSES
+
+
+# Перепроверка заданий этого процесса
+task_recheck_sweeper = TaskRecheckSweeper()
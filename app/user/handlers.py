@@ -1,6 +1,6 @@
 from aiogram import Router, F
 from aiogram.filters import CommandStart
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, ChatMemberUpdated
 from aiogram.types.input_file import FSInputFile
 from pathlib import Path
 from aiogram.filters import Command, StateFilter
@@ -58,6 +58,12 @@ async def start(mes: Message, command: CommandStart):
     # Создаем клавиатуру с кнопками каналов
     keyboard = []
     
+    # Проверяем все ОП каналы параллельно (ОП каналы всегда на подписки)
+    subscriptions = await subscribes_service.check_subscriptions(
+        mes.from_user.id,
+        [channel.channel_id for channel in op_channels if channel.channel_id != 0]
+    )
+    
     # Обрабатываем ОП каналы
     for channel in op_channels:
         # Если channel_id == 0, просто добавляем кнопку без проверок
@@ -68,14 +74,7 @@ async def start(mes: Message, command: CommandStart):
             )])
             continue
             
-        # Для остальных ОП каналов проверяем только подписку
-        is_subscribed = await subscribes_service.is_user_subscribed(
-            mes.from_user.id, 
-            channel.channel_id,
-            is_join_request=False  # ОП каналы всегда на подписки
-        )
-        
-        if not is_subscribed:
+        if not subscriptions[channel.channel_id]:
             keyboard.append([InlineKeyboardButton(
                 text=channel.button_name or channel.name,
                 url=channel.url
@@ -112,23 +111,13 @@ async def check_subscriptions(callback: CallbackQuery):
     # Получаем активные ОП каналы
     op_channels = await qu.get_active_sponsor_channels()  # ОП каналы
     
-    not_subscribed = []
-    
-    # Проверяем ОП каналы
-    for channel in op_channels:
-        # Пропускаем канал с ID 0
-        if channel.channel_id == 0:
-            continue
-            
-        # Для ОП каналов проверяем только подписку
-        is_subscribed = await subscribes_service.is_user_subscribed(
-            callback.from_user.id, 
-            channel.channel_id,
-            is_join_request=False  # ОП каналы всегда на подписки
-        )
-        
-        if not is_subscribed:
-            not_subscribed.append(channel)
+    # Проверяем ОП каналы параллельно, канал с ID 0 пропускаем
+    channels = [channel for channel in op_channels if channel.channel_id != 0]
+    subscriptions = await subscribes_service.check_subscriptions(
+        callback.from_user.id,
+        [channel.channel_id for channel in channels]
+    )
+    not_subscribed = [channel for channel in channels if not subscriptions[channel.channel_id]]
     
     if not_subscribed:
         # Создаем клавиатуру только с неподписанными каналами
@@ -469,6 +458,16 @@ async def process_withdraw_accept(callback: CallbackQuery):
     await callback.answer("Вывод успешно принят!", show_alert=True)
 
 
+@r.my_chat_member(F.chat.type == "private")
+async def bot_status_changed(event: ChatMemberUpdated):
+    """Отслеживает блокировку и разблокировку бота пользователем"""
+    status = event.new_chat_member.status
+    if status == "kicked":
+        await qu.mark_users_unreachable([event.from_user.id])
+    elif status == "member":
+        await qu.mark_user_reachable(event.from_user.id)
+
+
 @r.message(F.text == "Другие проекты")
 async def other_projects(mes: Message):
     await mes.answer("Другие наши проекты:", reply_markup=kb.other_projects)
@@ -3,6 +3,7 @@ from aiogram import BaseMiddleware
 from aiogram.types import Message, TelegramObject
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import logging
+from cachetools import TTLCache
 from ..database import db_queries as qu
 
 logger = logging.getLogger(__name__)
@@ -65,4 +66,30 @@ class AdPostMiddleware(BaseMiddleware):
             logger.error(f"Ошибка при отправке рекламного поста: {e}")
             
         # Продолжаем обработку оригинального сообщения
-        return await handler(event, data) 
\ No newline at end of file
+        return await handler(event, data) 
+
+class ReachabilityMiddleware(BaseMiddleware):
+    """
+    Middleware, которое возвращает пользователя в рассылки, если он снова пишет боту.
+    Чтобы не ходить в БД на каждое сообщение, пользователь проверяется не чаще раза в час.
+    """
+
+    def __init__(self):
+        self._recently_seen = TTLCache(maxsize=100_000, ttl=3600)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user and user.id not in self._recently_seen:
+            self._recently_seen[user.id] = True
+            try:
+                if await qu.mark_user_reachable(user.id):
+                    logger.info(f"Пользователь {user.id} снова доступен для рассылок")
+            except Exception as e:
+                logger.error(f"Ошибка при восстановлении пользователя {user.id}: {e}")
+
+        return await handler(event, data)
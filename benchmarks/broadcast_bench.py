@@ -0,0 +1,202 @@
+"""
+Бенчмарк пропускной способности рассылки.
+
+Поднимает локальный фейковый Bot API (benchmarks/fake_bot_api.py), направляет
+на него бота, наполняет базу N пользователями и прогоняет рассылку тем же путем,
+что и в бою: задача в broadcast_jobs, диапазоны, BroadcastWorker и BroadcastSender.
+
+В конце печатает скорость (сообщ/с), p50/p99 задержки отправки, количество
+ответов 429 и превышений лимита Telegram, зафиксированных сервером.
+
+По умолчанию используется временная SQLite-база (нужен пакет aiosqlite).
+Для MySQL передайте --database-url на ОТДЕЛЬНУЮ пустую базу: пользователи
+бенчмарка добавляются в таблицу users.
+
+Примеры:
+    python -m benchmarks.broadcast_bench --users 5000
+    python -m benchmarks.broadcast_bench --users 20000 --rate 28 --latency 0.08 --flood-rate 0.001
+    python -m benchmarks.broadcast_bench --database-url mysql+aiomysql://u:p@localhost/bench --users 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_bot_api import (  # noqa: E402
+    SEND_METHODS, FakeBotAPI, add_settings_arguments, percentile, settings_from_args
+)
+
+BENCH_TOKEN = '123456:BENCHMARK-TOKEN'
+ADMIN_CHAT_ID = 1
+FIRST_USER_ID = 10 ** 9
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Бенчмарк рассылки на фейковом Bot API')
+    parser.add_argument('--users', type=int, default=5000, help='Количество получателей')
+    parser.add_argument('--database-url', help='URL базы (по умолчанию временная SQLite)')
+    parser.add_argument('--payload', choices=['copy', 'album', 'text', 'photo'], default='copy',
+                        help='Тип рассылаемого сообщения')
+    parser.add_argument('--rate', type=float, help='BROADCAST_RATE, сообщений в секунду')
+    parser.add_argument('--workers', type=int, help='BROADCAST_WORKERS')
+    parser.add_argument('--shard-size', type=int, help='BROADCAST_SHARD_SIZE')
+    parser.add_argument('--timeout', type=float, default=3600, help='Максимальное время прогона, сек')
+    add_settings_arguments(parser)
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace) -> str:
+    """
+    Выставляет переменные окружения до импорта config.
+
+    Returns:
+        str: URL базы данных
+    """
+    database_url = args.database_url
+    if not database_url:
+        path = os.path.join(tempfile.mkdtemp(prefix='broadcast_bench_'), 'bench.sqlite3')
+        database_url = f"sqlite+aiosqlite:///{path}"
+
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('BOT_TOKEN', BENCH_TOKEN)
+    # Быстрый опрос, чтобы накладные расходы воркера не искажали результат
+    os.environ.setdefault('BROADCAST_POLL_INTERVAL', '1')
+    os.environ.setdefault('BROADCAST_PROGRESS_INTERVAL', '1')
+    overrides = {
+        'BROADCAST_RATE': args.rate,
+        'BROADCAST_WORKERS': args.workers,
+        'BROADCAST_SHARD_SIZE': args.shard_size,
+    }
+    for name, value in overrides.items():
+        if value is not None:
+            os.environ[name] = str(value)
+    return database_url
+
+
+def build_bench_payload(kind: str) -> str:
+    """Содержимое рассылки в формате build_payload"""
+    if kind in ('copy', 'album'):
+        payload = {
+            'type': 'copy',
+            'from_chat_id': ADMIN_CHAT_ID,
+            'message_ids': [1, 2, 3] if kind == 'album' else [1],
+            'reply_markup': None,
+        }
+    elif kind == 'photo':
+        payload = {'type': 'photo', 'file_id': 'BENCH_FILE_ID', 'text': 'Бенчмарк', 'parse_mode': 'HTML'}
+    else:
+        payload = {'type': 'text', 'text': '<b>Бенчмарк</b> рассылки', 'parse_mode': 'HTML'}
+    return json.dumps(payload, ensure_ascii=False)
+
+
+async def seed_users(count: int, batch_size: int = 10000):
+    """Добавляет count пользователей многострочными INSERT"""
+    from sqlalchemy import insert
+    from app.database.database import AsyncSessionFactory, User
+
+    async with AsyncSessionFactory() as session:
+        for start in range(0, count, batch_size):
+            rows = [
+                {'user_id': FIRST_USER_ID + i, 'username': f'bench_{i}', 'balans': 0, 'deposit': 0}
+                for i in range(start, min(start + batch_size, count))
+            ]
+            await session.execute(insert(User), rows)
+        await session.commit()
+
+
+async def run(args: argparse.Namespace, database_url: str):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import app.database.db_queries as qu
+    from app.database.database import create_all_tables, engine
+    from app.servise.broadcast_jobs import broadcast_worker
+    from config import Config
+
+    latencies: List[float] = []
+
+    class LatencyMiddleware(BaseRequestMiddleware):
+        """Замеряет время каждого запроса отправки на стороне бота"""
+
+        async def __call__(self, make_request, bot, method):
+            started = time.perf_counter()
+            try:
+                return await make_request(bot, method)
+            finally:
+                if method.__api_method__.lower() in SEND_METHODS:
+                    latencies.append(time.perf_counter() - started)
+
+    server = FakeBotAPI(settings_from_args(args))
+    await server.start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(server.base_url))
+    session.middleware(LatencyMiddleware())
+    bot = Bot(token=Config.BOT_TOKEN, session=session)
+
+    try:
+        await create_all_tables()
+        print(f"База: {database_url}")
+        print(f"Наполняем {args.users} пользователей...")
+        seed_started = time.perf_counter()
+        await seed_users(args.users)
+        print(f"Готово за {time.perf_counter() - seed_started:.1f} сек")
+
+        total = await qu.count_broadcast_recipients(None)
+        job_id = await qu.create_broadcast_job(
+            build_bench_payload(args.payload), total, ADMIN_CHAT_ID, ADMIN_CHAT_ID, 1
+        )
+        print(
+            f"Рассылка #{job_id}: {total} получателей, лимит {Config.BROADCAST_RATE} сообщ/с, "
+            f"воркеров {Config.BROADCAST_WORKERS}, задержка API {args.latency * 1000:.0f} мс"
+        )
+
+        started = time.perf_counter()
+        await broadcast_worker.start(bot)
+        broadcast_worker.wake()
+
+        job = await qu.get_broadcast_job(job_id)
+        while job.status == 'running' and time.perf_counter() - started < args.timeout:
+            await asyncio.sleep(0.5)
+            job = await qu.get_broadcast_job(job_id)
+        elapsed = time.perf_counter() - started
+        # Счетчики по диапазонам актуальны и для рассылки, прерванной по таймауту
+        totals = await qu.get_broadcast_job_totals(job_id)
+    finally:
+        await broadcast_worker.stop()
+        await bot.session.close()
+        await server.stop()
+        await engine.dispose()
+
+    stats = server.stats
+    processed = totals['success'] + totals['failed']
+    print()
+    print(f"Статус рассылки:            {job.status}")
+    print(f"Обработано:                 {processed} из {total}")
+    print(f"  успешно / ошибок:         {totals['success']} / {totals['failed']}")
+    print(f"  заблокировали бота:       {totals['unreachable']}")
+    print(f"Время:                      {elapsed:.1f} сек")
+    print(f"Скорость:                   {processed / elapsed if elapsed else 0:.1f} сообщ/с")
+    print(f"Задержка отправки p50/p99:  {percentile(latencies, 50) * 1000:.1f} / "
+          f"{percentile(latencies, 99) * 1000:.1f} мс")
+    print(f"Пиковая скорость на API:    {stats.peak_rate} сообщ/с")
+    print(f"Превышений лимита {server.settings.global_limit}/с:   {stats.limit_violations}")
+    print(f"Ответов 429:                {stats.flood_responses}")
+    print(f"Запросов по методам:        {stats.calls}")
+
+
+def main():
+    args = parse_args()
+    database_url = configure_environment(args)
+    asyncio.run(run(args, database_url))
+
+
+if __name__ == '__main__':
+    main()
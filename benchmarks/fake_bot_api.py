@@ -0,0 +1,270 @@
+"""
+Локальный фейковый сервер Telegram Bot API для бенчмарков.
+
+Реализует методы, которыми пользуется рассылка и проверка подписок:
+sendMessage, sendPhoto, copyMessage, copyMessages, editMessageText,
+editMessageReplyMarkup, answerCallbackQuery, deleteMessage и getMe.
+Дополнительные методы (например, getChatMember) подключаются через handlers.
+Задержка ответа, доля ошибок и ответы 429 настраиваются, а сервер считает
+превышения глобального лимита Telegram (~30 сообщений в секунду).
+
+Запуск отдельно:
+    python -m benchmarks.fake_bot_api --port 8081 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+# Методы, которые Telegram учитывает в лимите рассылки
+SEND_METHODS = {'sendmessage', 'sendphoto', 'copymessage', 'copymessages'}
+
+
+@dataclass
+class FakeApiSettings:
+    """
+    Поведение фейкового сервера.
+
+    Args:
+        latency (float): Средняя задержка ответа в секундах
+        jitter (float): Разброс задержки, доля от latency
+        distribution (str): Распределение задержки: uniform, exponential или lognormal
+        error_rate (float): Доля отправок, завершающихся 400 Bad Request
+        blocked_rate (float): Доля получателей, заблокировавших бота (403)
+        flood_rate (float): Доля отправок, получающих случайный 429
+        retry_after (int): retry_after в ответах 429
+        global_limit (int): Лимит сообщений в секунду, превышения которого считаются
+        enforce_limit (bool): Отвечать 429 на отправки сверх global_limit, как настоящий Telegram
+    """
+    latency: float = 0.05
+    jitter: float = 0.5
+    distribution: str = 'uniform'
+    error_rate: float = 0.0
+    blocked_rate: float = 0.0
+    flood_rate: float = 0.0
+    retry_after: int = 1
+    global_limit: int = 30
+    enforce_limit: bool = False
+
+
+@dataclass
+class FakeApiStats:
+    """Счетчики запросов, полученных сервером"""
+    calls: Dict[str, int] = field(default_factory=dict)
+    delivered: int = 0
+    errors: int = 0
+    blocked: int = 0
+    flood_responses: int = 0
+    limit_violations: int = 0  # Отправки сверх global_limit в скользящем окне 1 сек
+    peak_rate: int = 0  # Максимум отправок за любую секунду
+
+
+class FakeApiError(Exception):
+    """Ошибка, которую дополнительный обработчик метода возвращает клиенту"""
+
+    def __init__(self, code: int, description: str, parameters: Optional[dict] = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.parameters = parameters
+
+
+class FakeBotAPI:
+    """
+    aiohttp-приложение, имитирующее Bot API.
+
+    Бот подключается к нему через TelegramAPIServer.from_base(server.base_url).
+
+    Args:
+        settings (FakeApiSettings): Поведение сервера
+        host (str): Адрес для прослушивания
+        port (int): Порт, 0 — выбрать свободный
+    """
+
+    def __init__(self, settings: Optional[FakeApiSettings] = None, host: str = '127.0.0.1', port: int = 0):
+        self.settings = settings or FakeApiSettings()
+        self.stats = FakeApiStats()
+        self.host = host
+        self.port = port
+        self._window: deque = deque()
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+        # Дополнительные методы, например getChatMember для бенчмарка подписок
+        self.handlers: Dict[str, Callable[[dict], Awaitable[dict]]] = {}
+
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self._handle)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        """Запускает сервер в текущем event loop"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # При port=0 узнаем реально выбранный порт
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _track_rate(self) -> bool:
+        """Учитывает отправку в скользящем окне. Returns: True, если лимит превышен"""
+        now = time.monotonic()
+        self._window.append(now)
+        while self._window and self._window[0] <= now - 1:
+            self._window.popleft()
+        self.stats.peak_rate = max(self.stats.peak_rate, len(self._window))
+        if len(self._window) > self.settings.global_limit:
+            self.stats.limit_violations += 1
+            return True
+        return False
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        params = dict(await request.post())
+        self.stats.calls[method] = self.stats.calls.get(method, 0) + 1
+
+        settings = self.settings
+        if settings.latency:
+            await asyncio.sleep(self._delay())
+
+        if method in self.handlers:
+            try:
+                return self._ok(await self.handlers[method](params))
+            except FakeApiError as e:
+                return self._error(e.code, e.description, e.parameters)
+
+        if method in SEND_METHODS:
+            over_limit = self._track_rate()
+            if (over_limit and settings.enforce_limit) or random.random() < settings.flood_rate:
+                self.stats.flood_responses += 1
+                return self._error(
+                    429, f"Too Many Requests: retry after {settings.retry_after}",
+                    {'retry_after': settings.retry_after}
+                )
+            if random.random() < settings.blocked_rate:
+                self.stats.blocked += 1
+                return self._error(403, "Forbidden: bot was blocked by the user")
+            if random.random() < settings.error_rate:
+                self.stats.errors += 1
+                return self._error(400, "Bad Request: chat not found")
+            self.stats.delivered += 1
+
+        if method == 'getme':
+            return self._ok({'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'})
+        if method == 'copymessage':
+            return self._ok({'message_id': self._next_message_id()})
+        if method == 'copymessages':
+            count = len(str(params.get('message_ids', '[0]')).split(','))
+            return self._ok([{'message_id': self._next_message_id()} for _ in range(count)])
+        if method in ('sendmessage', 'sendphoto', 'editmessagetext', 'editmessagereplymarkup'):
+            return self._ok(self._message(params))
+        if method in ('answercallbackquery', 'deletemessage'):
+            return self._ok(True)
+        return self._error(404, f"Not Found: method {method} is not implemented")
+
+    def _delay(self) -> float:
+        """Задержка ответа по выбранному распределению со средним latency"""
+        settings = self.settings
+        if settings.distribution == 'exponential':
+            return random.expovariate(1 / settings.latency)
+        if settings.distribution == 'lognormal':
+            # Тяжелый хвост, как у реального API; jitter задает sigma
+            sigma = max(settings.jitter, 0.01)
+            return random.lognormvariate(math.log(settings.latency) - sigma ** 2 / 2, sigma)
+        return max(settings.latency * random.uniform(1 - settings.jitter, 1 + settings.jitter), 0)
+
+    def _next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': int(params.get('message_id') or self._next_message_id()),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text') or params.get('caption') or '',
+        }
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(code: int, description: str, parameters: Optional[dict] = None) -> web.Response:
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=code)
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser):
+    """Добавляет в парсер аргументы FakeApiSettings"""
+    defaults = FakeApiSettings()
+    parser.add_argument('--latency', type=float, default=defaults.latency, help='Средняя задержка ответа, сек')
+    parser.add_argument('--jitter', type=float, default=defaults.jitter, help='Разброс задержки, доля от latency')
+    parser.add_argument('--distribution', choices=['uniform', 'exponential', 'lognormal'],
+                        default=defaults.distribution, help='Распределение задержки')
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help='Доля ответов 400')
+    parser.add_argument('--blocked-rate', type=float, default=defaults.blocked_rate, help='Доля ответов 403')
+    parser.add_argument('--flood-rate', type=float, default=defaults.flood_rate, help='Доля случайных ответов 429')
+    parser.add_argument('--retry-after', type=int, default=defaults.retry_after, help='retry_after в ответах 429')
+    parser.add_argument('--global-limit', type=int, default=defaults.global_limit, help='Лимит сообщений в секунду')
+    parser.add_argument('--enforce-limit', action='store_true', help='Отвечать 429 при превышении лимита')
+
+
+def settings_from_args(args: argparse.Namespace) -> FakeApiSettings:
+    return FakeApiSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        distribution=args.distribution,
+        error_rate=args.error_rate,
+        blocked_rate=args.blocked_rate,
+        flood_rate=args.flood_rate,
+        retry_after=args.retry_after,
+        global_limit=args.global_limit,
+        enforce_limit=args.enforce_limit,
+    )
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль p (0..100) по списку значений"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _serve(args: argparse.Namespace):
+    server = FakeBotAPI(settings_from_args(args), args.host, args.port)
+    await server.start()
+    print(f"Фейковый Bot API слушает {server.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Фейковый Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    add_settings_arguments(parser)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
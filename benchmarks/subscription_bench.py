@@ -0,0 +1,298 @@
+"""
+Бенчмарк задержки проверки подписок.
+
+Поднимает локальный фейковый Bot API (benchmarks/fake_bot_api.py), в котором
+getChatMember отвечает с настраиваемой задержкой и долей ошибок, и прогоняет
+через диспетчер настоящие апдейты тем же путем, что и в бою:
+/start, нажатие «Я подписался» (check_subscriptions), выдачу задания («📚 Задания»)
+и проверку задания (check_task:). Задание выдается до проверки, поэтому check_task
+проходит настоящее выполнение: complete_task, начисление награды и каталог заданий.
+
+Для каждого количества ОП каналов (по умолчанию 1, 2, 5, 10, 15, 20) печатает
+p50/p95/p99 полной обработки апдейта и число getChatMember на апдейт.
+
+По умолчанию каждый прогон идет от новых пользователей (холодный кэш подписок).
+С --warm те же пользователи сначала проходят прогон без замеров
+(задание к замеру уже выполнено, check_task меряет повторное нажатие).
+
+По умолчанию используется временная SQLite-база (нужен пакет aiosqlite).
+Для MySQL передайте --database-url на ОТДЕЛЬНУЮ пустую базу: бенчмарк
+перезаписывает таблицу op_channels и добавляет пользователей и задания.
+
+Примеры:
+    python -m benchmarks.subscription_bench --updates 200
+    python -m benchmarks.subscription_bench --channels 1,5,20 --latency 0.1 --distribution lognormal --jitter 0.8
+    python -m benchmarks.subscription_bench --subscribed-rate 0.5 --member-error-rate 0.01 --concurrency 20 --warm
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_bot_api import (  # noqa: E402
+    FakeApiError, FakeBotAPI, add_settings_arguments, percentile, settings_from_args
+)
+
+BENCH_TOKEN = '123456:BENCHMARK-TOKEN'
+FIRST_USER_ID = 2 * 10 ** 9
+FIRST_CHANNEL_ID = -1001000000000
+TASK_CHANNEL_ID = -1002000000000
+
+# Виды апдейтов в порядке прогона
+SCENARIOS = ('start', 'check_subscriptions', 'tasks', 'check_task')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Бенчмарк проверки подписок на фейковом Bot API')
+    parser.add_argument('--channels', default='1,2,5,10,15,20', help='Количества ОП каналов через запятую')
+    parser.add_argument('--updates', type=int, default=100, help='Апдейтов каждого вида на прогон')
+    parser.add_argument('--concurrency', type=int, default=1, help='Сколько апдейтов обрабатывается одновременно')
+    parser.add_argument('--subscribed-rate', type=float, default=0.0,
+                        help='Доля пар (пользователь, канал), где пользователь подписан')
+    parser.add_argument('--task-subscribed-rate', type=float, default=1.0,
+                        help='Доля пользователей, подписанных на канал задания')
+    parser.add_argument('--member-error-rate', type=float, default=0.0,
+                        help='Доля ответов getChatMember с ошибкой 400 "user not found"')
+    parser.add_argument('--warm', action='store_true', help='Прогреть кэши подписок прогоном без замеров')
+    parser.add_argument('--database-url', help='URL базы (по умолчанию временная SQLite)')
+    add_settings_arguments(parser)
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace) -> str:
+    """
+    Выставляет переменные окружения до импорта config.
+
+    Returns:
+        str: URL базы данных
+    """
+    database_url = args.database_url
+    if not database_url:
+        path = os.path.join(tempfile.mkdtemp(prefix='subscription_bench_'), 'bench.sqlite3')
+        database_url = f"sqlite+aiosqlite:///{path}"
+
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('BOT_TOKEN', BENCH_TOKEN)
+    return database_url
+
+
+def is_subscribed(user_id: int, channel_id: int, rate: float) -> bool:
+    """Детерминированная подписка: повторные запросы той же пары отвечают одинаково"""
+    return random.Random(user_id * 7919 + channel_id).random() < rate
+
+
+def make_get_chat_member(args: argparse.Namespace):
+    """Обработчик getChatMember для фейкового сервера"""
+    async def get_chat_member(params: dict) -> dict:
+        if random.random() < args.member_error_rate:
+            raise FakeApiError(400, "Bad Request: user not found")
+        user_id, channel_id = int(params['user_id']), int(params['chat_id'])
+        rate = args.task_subscribed_rate if channel_id == TASK_CHANNEL_ID else args.subscribed_rate
+        status = 'member' if is_subscribed(user_id, channel_id, rate) else 'left'
+        return {'status': status, 'user': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'}}
+    return get_chat_member
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench_{user_id}'}
+
+
+def _message(user_id: int, message_id: int, text: str) -> dict:
+    return {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text,
+    }
+
+
+def build_update(kind: str, update_id: int, user_id: int, task_id: int) -> dict:
+    """Апдейт Telegram в виде словаря для feed_raw_update"""
+    if kind == 'start':
+        return {'update_id': update_id, 'message': _message(user_id, update_id, '/start')}
+    if kind == 'tasks':
+        return {'update_id': update_id, 'message': _message(user_id, update_id, '📚 Задания')}
+    data = 'check_subscriptions' if kind == 'check_subscriptions' else f'check_task:{task_id}'
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': _message(user_id, update_id, 'Бенчмарк'),
+        },
+    }
+
+
+async def seed_channels(count: int) -> int:
+    """
+    Пересоздает ОП каналы и одно задание на подписку.
+
+    Returns:
+        int: ID задания
+    """
+    from sqlalchemy import delete, insert, select
+    from app.database.database import AsyncSessionFactory, Chanel, OPChannel
+
+    async with AsyncSessionFactory() as session:
+        await session.execute(delete(OPChannel))
+        await session.execute(insert(OPChannel), [
+            {
+                'channel_id': FIRST_CHANNEL_ID - i,
+                'url': f'https://t.me/+bench{i}',
+                'name': f'Канал {i + 1}',
+                'limit': 10 ** 9,
+                'is_active': True,
+            }
+            for i in range(count)
+        ])
+
+        task_id = (await session.execute(
+            select(Chanel.id).where(Chanel.chanel_id == TASK_CHANNEL_ID)
+        )).scalar_one_or_none()
+        if task_id is None:
+            result = await session.execute(insert(Chanel).values(
+                chanel_id=TASK_CHANNEL_ID, chanel_name='Задание', link='https://t.me/+benchtask',
+                is_active=True, sab=True, limit=10 ** 9, reward=1,
+            ))
+            task_id = result.inserted_primary_key[0]
+        await session.commit()
+    return task_id
+
+
+async def count_completed_tasks(task_id: int) -> int:
+    """Сколько пользователей выполнили задание бенчмарка"""
+    from sqlalchemy import func, select
+    from app.database.database import AsyncSessionFactory, UserTask
+
+    async with AsyncSessionFactory() as session:
+        result = await session.execute(
+            select(func.count()).select_from(UserTask).where(
+                UserTask.task_id == task_id, UserTask.completed == True
+            )
+        )
+        return result.scalar_one()
+
+
+async def run_scenario(dp, bot, server: FakeBotAPI, kind: str, user_ids: List[int], task_id: int,
+                       concurrency: int, update_ids) -> Dict[str, float]:
+    """
+    Прогоняет апдейты одного вида для всех пользователей.
+
+    Returns:
+        dict: Перцентили задержки в мс и getChatMember на апдейт
+    """
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    calls_before = server.stats.calls.get('getchatmember', 0)
+
+    async def feed(user_id: int):
+        update = build_update(kind, next(update_ids), user_id, task_id)
+        async with semaphore:
+            started = time.perf_counter()
+            await dp.feed_raw_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(feed(user_id) for user_id in user_ids))
+    calls = server.stats.calls.get('getchatmember', 0) - calls_before
+    return {
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'calls': calls / len(user_ids) if user_ids else 0,
+    }
+
+
+async def run(args: argparse.Namespace, database_url: str):
+    from itertools import count
+
+    from aiogram import Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import app.bot
+    from app.database.database import create_all_tables, engine
+    from app.servise.subscribes_service import r as subscribes_r
+    from app.servise.task_handlers import router as task_r
+    from app.user.handlers import r as user_r
+
+    server = FakeBotAPI(settings_from_args(args))
+    server.handlers['getchatmember'] = make_get_chat_member(args)
+    await server.start()
+
+    # Проверки подписки ходят через общий бот приложения, поэтому направляем на сервер его
+    bot = app.bot.bot
+    await bot.session.close()
+    bot.session = AiohttpSession(api=TelegramAPIServer.from_base(server.base_url))
+
+    dp = Dispatcher()
+    dp.include_router(user_r)
+    dp.include_router(task_r)
+    dp.include_router(subscribes_r)
+
+    channel_counts = [int(value) for value in args.channels.split(',') if value.strip()]
+    update_ids = count(1)
+    results = {}
+
+    try:
+        await create_all_tables()
+        print(f"База: {database_url}")
+        print(
+            f"Задержка API {args.latency * 1000:.0f} мс ({args.distribution}), "
+            f"подписаны {args.subscribed_rate:.0%}, ошибок getChatMember {args.member_error_rate:.1%}, "
+            f"апдейтов каждого вида {args.updates}, одновременно {args.concurrency}"
+        )
+
+        for run_index, channels in enumerate(channel_counts):
+            task_id = await seed_channels(channels)
+            # Новые пользователи на каждый прогон, чтобы кэши прошлых прогонов не влияли
+            first_user = FIRST_USER_ID + run_index * args.updates
+            user_ids = list(range(first_user, first_user + args.updates))
+
+            if args.warm:
+                for kind in SCENARIOS:
+                    await run_scenario(dp, bot, server, kind, user_ids, task_id, args.concurrency, update_ids)
+
+            results[channels] = {
+                kind: await run_scenario(dp, bot, server, kind, user_ids, task_id, args.concurrency, update_ids)
+                for kind in SCENARIOS
+            }
+            print(f"  {channels} ОП каналов: готово")
+        completed = await count_completed_tasks(task_id)
+    finally:
+        await bot.session.close()
+        await server.stop()
+        await engine.dispose()
+
+    print()
+    print(f"{'каналов':>8} {'апдейт':<20} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'getChatMember':>14}")
+    for channels, scenarios in results.items():
+        for kind, stats in scenarios.items():
+            print(
+                f"{channels:>8} {kind:<20} {stats['p50']:>9.1f} {stats['p95']:>9.1f} "
+                f"{stats['p99']:>9.1f} {stats['calls']:>14.2f}"
+            )
+    print()
+    print(f"Выполнено заданий: {completed}")
+    print(f"Запросов по методам: {server.stats.calls}")
+
+
+def main():
+    args = parse_args()
+    database_url = configure_environment(args)
+    # Ошибки getChatMember ожидаемы при --member-error-rate и не должны засорять вывод
+    logging.basicConfig(level=logging.CRITICAL)
+    asyncio.run(run(args, database_url))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,7 +21,40 @@ class Config:
     LOG = os.getenv("LOG")
     OTZIVI_URL = os.getenv("OTZIVI_URL")
 
+    # Настройки рассылки
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 28))  # Глобальный лимит сообщений в секунду
+    BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 30))  # Количество параллельных воркеров
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5))  # Обновление прогресса не чаще раза в N секунд
+    BROADCAST_CHECKPOINT_EVERY = int(os.getenv("BROADCAST_CHECKPOINT_EVERY", 200))  # Сохранение прогресса каждые N отправок
+    BROADCAST_SHARD_SIZE = int(os.getenv("BROADCAST_SHARD_SIZE", 50000))  # Получателей в одном диапазоне
+    BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", 60))  # Срок аренды диапазона воркером
+    BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", 10))  # Как часто искать свободные диапазоны
+    BROADCAST_DELIVERY_BATCH = int(os.getenv("BROADCAST_DELIVERY_BATCH", 500))  # Строк журнала доставки в одном INSERT
+    BROADCAST_DELIVERY_FLUSH_INTERVAL = float(os.getenv("BROADCAST_DELIVERY_FLUSH_INTERVAL", 2))  # Запись журнала не реже раза в N секунд
+
+
+    # Настройки проверки подписок
+    SUBSCRIPTION_CHECK_CONCURRENCY = int(os.getenv("SUBSCRIPTION_CHECK_CONCURRENCY", 8))  # Одновременных getChatMember на пользователя
+    SUBSCRIPTION_CHECK_TIMEOUT = float(os.getenv("SUBSCRIPTION_CHECK_TIMEOUT", 3))  # Общий дедлайн проверки всех каналов, сек
+    SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", 100000))  # Пар (пользователь, канал) в кэше
+    SUBSCRIPTION_POSITIVE_TTL = float(os.getenv("SUBSCRIPTION_POSITIVE_TTL", 600))  # Сколько помнить подтвержденную подписку, сек
+    SUBSCRIPTION_NEGATIVE_TTL = float(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", 5))  # Сколько помнить отсутствие подписки, сек
+    JOIN_REQUEST_BATCH = int(os.getenv("JOIN_REQUEST_BATCH", 500))  # Заявок на вступление в одном upsert
+    JOIN_REQUEST_FLUSH_INTERVAL = float(os.getenv("JOIN_REQUEST_FLUSH_INTERVAL", 1))  # Запись заявок не реже раза в N секунд
+    CHANNEL_BREAKER_THRESHOLD = int(os.getenv("CHANNEL_BREAKER_THRESHOLD", 3))  # Ошибок канала подряд до отключения проверок
+    CHANNEL_BREAKER_COOLDOWN = float(os.getenv("CHANNEL_BREAKER_COOLDOWN", 60))  # Пауза до пробного запроса, сек
+    CHANNEL_BREAKER_MAX_COOLDOWN = float(os.getenv("CHANNEL_BREAKER_MAX_COOLDOWN", 1800))  # Максимальная пауза, сек
+    CHANNEL_PROBE_INTERVAL = float(os.getenv("CHANNEL_PROBE_INTERVAL", 600))  # Как часто проверять все каналы, сек
+    CHANNEL_PROBE_RATE = float(os.getenv("CHANNEL_PROBE_RATE", 1))  # Запросов проверки каналов в секунду
+    TASK_RECHECK_INTERVAL = float(os.getenv("TASK_RECHECK_INTERVAL", 3600))  # Как часто перепроверять выполненные задания, сек
+    TASK_RECHECK_DAYS = int(os.getenv("TASK_RECHECK_DAYS", 7))  # За сколько последних дней перепроверять задания
+    TASK_RECHECK_RATE = float(os.getenv("TASK_RECHECK_RATE", 2))  # Запросов перепроверки в секунду
+    TASK_RECHECK_YIELD_RATE = float(os.getenv("TASK_RECHECK_YIELD_RATE", 10))  # Пауза, пока пользовательских проверок больше N в секунду
+    MEMBERSHIP_INDEX_SIZE = int(os.getenv("MEMBERSHIP_INDEX_SIZE", 1000000))  # Пар (пользователь, канал) из апдейтов chat_member
+    TASK_CATALOG_TTL = float(os.getenv("TASK_CATALOG_TTL", 60))  # Как часто перечитывать каталог заданий из БД, сек
+    TASK_COMPLETED_CACHE_SIZE = int(os.getenv("TASK_COMPLETED_CACHE_SIZE", 100000))  # Пользователей с выполненными заданиями в памяти
     
-    DATABASE_URL = (
+    # DATABASE_URL из окружения переопределяет MySQL (например, sqlite+aiosqlite для бенчмарков)
+    DATABASE_URL = os.getenv("DATABASE_URL") or (
         f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     )
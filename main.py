@@ -11,7 +11,11 @@ from app.user.handlers import r as user_r
 from app.servise.task_handlers import router as task_r
 from app.admin.handlers import router as admin_router  # Добавляем импорт админ-роутера
 from app.servise.broadcast import router as broadcast_router
+from app.servise.broadcast_jobs import broadcast_worker
+from app.servise.channel_health import channel_prober
+from app.servise.task_recheck import task_recheck_sweeper
 from app.servise.subscribes_service import r as subscribes_r
+from app.user.middleware import ReachabilityMiddleware
 # Инициализация colorama
 init()
 
@@ -60,9 +64,10 @@ async def main():
     logger.info(f"{Fore.CYAN}{'~' * 50}\n")
 
     try:
-        # Запускаем сервис подписок
-        await subscribes_service.start()
-        logger.info("Сервис подписок запущен")
+        # Возвращаем в рассылки пользователей, которые снова пишут боту
+        reachability_middleware = ReachabilityMiddleware()
+        dp.message.outer_middleware(reachability_middleware)
+        dp.callback_query.outer_middleware(reachability_middleware)
 
         #подключаем роутеры
         dp.include_router(user_r)
@@ -74,13 +79,22 @@ async def main():
         bot_info = await bot.get_me()
         logger.info(f"Бот успешно подключен: @{bot_info.username}")
 
-        # Регистрируем обработчики сервиса подписок
-        dp.chat_join_request.register(subscribes_service.on_chat_member_update)
-        logger.info("Обработчик заявок на вступление зарегистрирован")
         
         # Создаем таблицы
         await create_all_tables()
         logger.info("База данных инициализирована")
+
+        # Запускаем сервис подписок: его фоновые задачи работают с таблицей join_requests
+        await subscribes_service.start()
+        logger.info("Сервис подписок запущен")
+
+        # Запускаем воркер рассылок: он продолжит прерванные рассылки и подхватит новые
+        await broadcast_worker.start(bot)
+
+        # Фоновая проверка, что бот все еще администратор ОП каналов и каналов заданий
+        channel_prober.start()
+        # Фоновая перепроверка подписок по выполненным заданиям (удержание подписчиков)
+        task_recheck_sweeper.start()
         
         # Отправляем уведомления админам
         await notify_admins()
@@ -88,7 +102,8 @@ async def main():
         
         # Запускаем бота
         logger.info("Запускаем поллинг...")
-        await dp.start_polling(bot)
+        # chat_member Telegram присылает только по явному запросу в allowed_updates
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
         logger.info("Бот запущен")
 
     except Exception as e:
@@ -96,6 +111,11 @@ async def main():
         raise
     finally:
         # Останавливаем сервис автопостов при завершении работы
+        await broadcast_worker.stop()
+        await channel_prober.stop()
+        await task_recheck_sweeper.stop()
+        # Дописываем накопленные заявки на вступление в БД
+        await subscribes_service.stop()
         await bot.session.close()
         logger.info("Бот остановлен")
 
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import unittest
+
+# Модули приложения читают конфиг при импорте
+os.environ.setdefault('BOT_TOKEN', '123456:TEST-TOKEN')
+os.environ.setdefault('DATABASE_URL', 'sqlite+aiosqlite:///:memory:')
+
+from app.servise.channel_health import ChannelCircuitBreaker, ChannelUnavailable  # noqa: E402
+
+CHANNEL_ID = -1001
+
+
+class CancelledProbeTest(unittest.TestCase):
+    """Отмененный пробный запрос не должен навсегда оставлять канал недоступным"""
+
+    def test_cancelled_probe_allows_next_probe(self):
+        asyncio.run(self._scenario())
+
+    async def _scenario(self):
+        closed = []
+
+        async def on_close(channel_id: int):
+            closed.append(channel_id)
+
+        breaker = ChannelCircuitBreaker(threshold=1, cooldown=0, max_cooldown=0, on_close=on_close)
+        # Размыкаем цепь вручную: cooldown=0, поэтому следующий вызов сразу пробный
+        breaker._record_failure(CHANNEL_ID, "Bad Request: chat not found")
+        self.assertTrue(breaker.is_open(CHANNEL_ID))
+
+        started = asyncio.Event()
+
+        async def slow_request():
+            started.set()
+            await asyncio.sleep(3600)
+
+        probe = asyncio.create_task(breaker.call(CHANNEL_ID, slow_request))
+        await started.wait()
+        # Так check_subscriptions отменяет проверки по SUBSCRIPTION_CHECK_TIMEOUT
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+
+        self.assertFalse(breaker._circuits[CHANNEL_ID].probing)
+
+        async def ok_request():
+            return 'member'
+
+        self.assertEqual(await breaker.call(CHANNEL_ID, ok_request), 'member')
+        self.assertFalse(breaker.is_open(CHANNEL_ID))
+        await asyncio.sleep(0)  # Уведомление о восстановлении отправляется задачей
+        self.assertEqual(closed, [CHANNEL_ID])
+
+    def test_probe_in_flight_blocks_other_calls(self):
+        asyncio.run(self._in_flight())
+
+    async def _in_flight(self):
+        breaker = ChannelCircuitBreaker(threshold=1, cooldown=0, max_cooldown=0)
+        breaker._record_failure(CHANNEL_ID, "Bad Request: chat not found")
+
+        release = asyncio.Event()
+
+        async def blocked_request():
+            await release.wait()
+            return 'member'
+
+        probe = asyncio.create_task(breaker.call(CHANNEL_ID, blocked_request))
+        await asyncio.sleep(0)
+        with self.assertRaises(ChannelUnavailable):
+            await breaker.call(CHANNEL_ID, blocked_request)
+        release.set()
+        self.assertEqual(await probe, 'member')
+
+
+if __name__ == '__main__':
+    unittest.main()